@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_TOKEN = "123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi"
+
+# Доли сценариев в потоке апдейтов
+FLOWS = {"play": 40, "stats": 20, "top": 15, "open": 15, "promo": 10}
+
+# Метки storage.BYTES_WRITTEN
+WRITE_KINDS = ("snapshot", "journal", "chat")
+
+
+# --- Синтетические данные ---
+def chat_id_for(index):
+    return -1000000000000 - index
+
+
+def user_id_for(chat_index, index, players_per_chat):
+    return 10000000 + chat_index * players_per_chat + index
+
+
+def write_players(path, players, players_per_chat, seed):
+    """Файл данных в формате JsonStore: players игроков по players_per_chat в чате"""
+    rng = random.Random(seed)
+    chats = max(1, players // players_per_chat)
+    data = {}
+    for chat_index in range(chats):
+        # Остаток игроков достаётся последнему чату
+        count = players - chat_index * players_per_chat if chat_index == chats - 1 else players_per_chat
+        data[str(chat_id_for(chat_index))] = {"players": {
+            str(user_id_for(chat_index, index, players_per_chat)): {
+                "wins": rng.randint(0, 500),
+                "points": 1000000,
+                "last_play": 0,
+                "username": f"user{index}"
+            }
+            for index in range(count)
+        }}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    return chats
+
+
+def build_updates(count, chats, players_per_chat, cases, promo_codes, seed):
+    """Список (сценарий, Update) для прогона через Dispatcher"""
+    from aiogram import types
+
+    rng = random.Random(seed)
+    ids = itertools.count(1)
+    now = datetime.datetime.now()
+    flows = list(FLOWS)
+    weights = list(FLOWS.values())
+
+    def message(chat, user, text):
+        return types.Update(update_id=next(ids), message=types.Message(
+            message_id=next(ids), date=now, chat=chat, from_user=user, text=text
+        ))
+
+    def callback(chat, user, data):
+        bot_message = types.Message(message_id=next(ids), date=now, chat=chat, text="…")
+        return types.Update(update_id=next(ids), callback_query=types.CallbackQuery(
+            id=str(next(ids)), from_user=user, chat_instance=str(chat.id), message=bot_message, data=data
+        ))
+
+    updates = []
+    for flow in rng.choices(flows, weights=weights, k=count):
+        chat_index = rng.randrange(chats)
+        chat = types.Chat(id=chat_id_for(chat_index), type="supergroup")
+        user_id = user_id_for(chat_index, rng.randrange(players_per_chat), players_per_chat)
+        user = types.User(id=user_id, is_bot=False, first_name=f"u{user_id}")
+        if flow == "play":
+            update = message(chat, user, rng.choice(["/t", "/ct"]))
+        elif flow == "stats":
+            update = message(chat, user, "/stats")
+        elif flow == "top":
+            update = message(chat, user, "/top") if rng.random() < 0.5 else callback(chat, user, f"top_page_{rng.randrange(3)}")
+        elif flow == "open":
+            update = callback(chat, user, f"open_{rng.choice(cases)}")
+        else:
+            update = message(chat, user, f"/promo {rng.choice(promo_codes)}")
+        updates.append((flow, update))
+    return updates
+
+
+# --- Заглушка сессии ---
+def make_session():
+    from aiogram import types
+    from aiogram.client.session.base import BaseSession
+
+    class RecordingSession(BaseSession):
+        """Вместо запросов к Telegram считает их и отдаёт правдоподобные ответы"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+            self.message_ids = itertools.count(1)
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            name = type(method).__name__
+            if name in ("SendMessage", "SendPhoto"):
+                return types.Message(
+                    message_id=next(self.message_ids),
+                    date=datetime.datetime.now(),
+                    chat=types.Chat(id=method.chat_id, type="supergroup")
+                )
+            if name == "GetChatMember":
+                return types.ChatMemberMember(user=types.User(id=method.user_id, is_bot=False, first_name="u"))
+            if name == "GetMe":
+                return types.User(id=1, is_bot=True, first_name="bench", username="bench_bot")
+            return True
+
+    return RecordingSession()
+
+
+# --- Прогон одного сценария (в отдельном процессе: bot.py хранит состояние в модуле) ---
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3)
+    }
+
+
+def run_scenario(players, players_per_chat, updates_count, alloc_updates, backend, seed):
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        os.chdir(work_dir)
+        started = time.perf_counter()
+        chats = write_players("csgo_data.json", players, players_per_chat, seed)
+        os.environ.update({
+            "BOT_TOKEN": FAKE_TOKEN,
+            "STORAGE_BACKEND": backend,
+            "COOLDOWN_HOURS": "0",
+            "PROMO_FILE": os.path.join(CODE_DIR, "promo_codes.json"),
+            # Лимиты Telegram не нужны: измеряется сам бот
+            "OUTBOX_GLOBAL_RATE": "1000000000",
+            "OUTBOX_CHAT_PER_MINUTE": "1000000000",
+            "OUTBOX_CHAT_BURST": "1000000000",
+            # Синтетические игроки жмут кнопки чаще живых, антиспам исказил бы замер
+            "THROTTLE_LIMITS": "",
+            "THROTTLE_DEDUP_SECONDS": "0"
+        })
+        sys.path.insert(0, CODE_DIR)
+        import bot
+        import storage
+        load_seconds = time.perf_counter() - started
+
+        session = make_session()
+        session.middleware = bot.bot.session.middleware
+        bot.bot.session = session
+        updates = build_updates(
+            updates_count + alloc_updates, chats, min(players, players_per_chat),
+            list(bot.CASES), list(bot.promo_ledger.codes), seed
+        )
+        result = asyncio.run(measure(bot, storage, updates[:updates_count], updates[updates_count:]))
+        return {
+            "players": players,
+            "chats": chats,
+            "backend": backend,
+            "load_seconds": round(load_seconds, 3)
+        } | result
+    finally:
+        os.chdir(CODE_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def measure(bot, storage, updates, alloc_updates):
+    bot.store.start()
+    bot.deletes.start()
+    written_before = sum(storage.BYTES_WRITTEN.get(kind=kind) for kind in WRITE_KINDS)
+    try:
+        latencies = {flow: [] for flow in FLOWS}
+        started = time.perf_counter()
+        for flow, update in updates:
+            update_started = time.perf_counter()
+            await bot.dp.feed_update(bot.bot, update)
+            latencies[flow].append(time.perf_counter() - update_started)
+        elapsed = time.perf_counter() - started
+
+        # Аллокации меряются отдельным коротким прогоном: tracemalloc сильно замедляет код
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        for flow, update in alloc_updates:
+            await bot.dp.feed_update(bot.bot, update)
+        _, peak = tracemalloc.get_traced_memory()
+        retained = tracemalloc.take_snapshot().compare_to(before, "filename")
+        tracemalloc.stop()
+    finally:
+        await bot.deletes.stop()
+        await bot.outbox.close()
+        bot.promo_ledger.close()
+        bot.store.close()
+
+    written = sum(storage.BYTES_WRITTEN.get(kind=kind) for kind in WRITE_KINDS) - written_before
+    if bot.STORAGE_BACKEND == "sqlite":
+        # SQLite пишет страницы сам и переиспользует WAL после контрольной точки,
+        # рост файлов записанное не отражает - метрики для него нет
+        written = None
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "updates": len(updates),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(updates) / elapsed, 1),
+        "latency": summarize(all_latencies),
+        "flows": {flow: summarize(values) for flow, values in latencies.items() if values},
+        "telegram_calls": bot.bot.session.calls,
+        "storage_bytes_written": written,
+        "alloc": {
+            "updates": len(alloc_updates),
+            "peak_bytes": peak,
+            "retained_bytes": sum(stat.size_diff for stat in retained),
+            "retained_blocks": sum(stat.count_diff for stat in retained)
+        }
+    }
+
+
+# --- Сравнение с прошлым прогоном ---
+def compare(baseline, results, tolerance):
+    """Печатает изменения относительно baseline и возвращает число регрессий.
+    Коэффициент больше 1 - стало хуже"""
+    previous = {(scenario["players"], scenario["backend"]): scenario for scenario in baseline["scenarios"]}
+    regressions = 0
+    for scenario in results["scenarios"]:
+        old = previous.get((scenario["players"], scenario["backend"]))
+        if old is None:
+            continue
+        checks = [
+            ("p99_ms", scenario["latency"]["p99_ms"] / old["latency"]["p99_ms"]),
+            ("updates_per_sec", old["updates_per_sec"] / scenario["updates_per_sec"]),
+        ]
+        for name, ratio in checks:
+            mark = "РЕГРЕССИЯ" if ratio > 1 + tolerance else "ok"
+            regressions += mark != "ok"
+            print(f"{scenario['players']:>9} игроков {name:>16}: x{ratio:.2f} {mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обработки апдейтов через Dispatcher без обращений к Telegram")
+    parser.add_argument("--scales", default="10,1000,100000,1000000", help="число игроков в сценариях через запятую")
+    parser.add_argument("--players-per-chat", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--alloc-updates", type=int, default=500)
+    parser.add_argument("--backend", default="json", choices=["json", "compact", "snapshot", "chatdir", "journal", "sqlite"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="прошлый результат для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "scenarios": []
+    }
+    context = multiprocessing.get_context("spawn")
+    for players in (int(scale) for scale in args.scales.split(",")):
+        with context.Pool(1) as pool:
+            scenario = pool.apply(run_scenario, (
+                players, args.players_per_chat, args.updates, args.alloc_updates, args.backend, args.seed
+            ))
+        results["scenarios"].append(scenario)
+        print(
+            f"{players:>9} игроков: {scenario['updates_per_sec']} апд/с, "
+            f"p50 {scenario['latency']['p50_ms']} мс, p99 {scenario['latency']['p99_ms']} мс, "
+            f"записано {'н/д' if scenario['storage_bytes_written'] is None else scenario['storage_bytes_written']} байт"
+        )
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
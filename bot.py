@@ -1,14 +1,36 @@
+import html
 import logging
 import os
 import random
-import json
-from datetime import datetime, timedelta
+from datetime import timedelta
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from typing import Union
 import asyncio
+import time
+from storage import (
+    ChatDirStore, CompactStore, JsonStore, SnapshotStore, JournalStore, SQLiteStore,
+    migrate_json_to_sqlite, split_json_to_chat_dir
+)
+from locks import KeyedLocks
+from leaderboard import ChatLeaderboards, GlobalStats
+from names import NameCache, NameRefreshMiddleware
+from scheduler import DeleteScheduler
+from sampler import compile_case_samplers
+from promo import PromoLedger
+from cooldowns import CooldownNotifier
+from outbox import SendQueue
+from webhook import run_webhook
+from media import MediaCache
+from sharding import connect_promo_coordinator, run_worker, shard_of
+from metrics import start_metrics_server
+from profiling import Profiler, parse_signal_mapping
+from throttle import ThrottleMiddleware, parse_limits
+from seasons import SeasonRunner, SeasonScheduler, parse_rewards
+from export import export_files
+from monitoring import ApiMetricsMiddleware, OUTCOMES, SWALLOWED_ERRORS, instrument_store, setup_dispatcher_metrics
 
 # --- Настройка ---
 load_dotenv()
@@ -17,16 +39,166 @@ if not BOT_TOKEN:
     logging.error("Токен бота не найден в .env файле")
     exit(1)
 
-DATA_FILE = "csgo_data.json"
+DATA_FILE = os.getenv("DATA_FILE", "csgo_data.json")
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "5"))
+FLUSH_THRESHOLD = int(os.getenv("FLUSH_THRESHOLD", "200"))
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+# polling - long polling, webhook - встроенный aiohttp-сервер
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # внешний адрес; если задан, вебхук регистрируется в Telegram
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+
+# Все отправки идут через очередь с лимитами Telegram (общий и на чат);
+# сверх OUTBOX_MAX_WAITING запросов в очереди наименее важные сбрасываются
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_CHAT_PER_MINUTE = float(os.getenv("OUTBOX_CHAT_PER_MINUTE", "20"))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "5"))
+OUTBOX_MAX_WAITING = int(os.getenv("OUTBOX_MAX_WAITING", "10000"))
+outbox = SendQueue(
+    global_rate=OUTBOX_GLOBAL_RATE,
+    chat_rate=OUTBOX_CHAT_PER_MINUTE / 60,
+    chat_burst=OUTBOX_CHAT_BURST,
+    max_waiting=OUTBOX_MAX_WAITING
+)
+bot.session.middleware(outbox)
+
+# Номер этого шарда и число шардов - задаёт sharding.py при запуске воркеров
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 - выключено).
+# В режиме шардов каждый воркер слушает METRICS_PORT + номер шарда
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+if METRICS_PORT:
+    METRICS_PORT += SHARD_INDEX
+bot.session.middleware(ApiMetricsMiddleware())
+
+# Защита от спама кнопками: не больше N действий за T секунд на (чат, игрок, действие)
+# и отсев одинаковых нажатий подряд. Действия - флаг "throttle" у обработчиков
+THROTTLE_LIMITS = parse_limits(os.getenv(
+    "THROTTLE_LIMITS", "play=4/10,stats=3/10,top=3/10,open=6/10,promo=3/30,menu=5/10,settings=3/30"
+))
+THROTTLE_DEDUP_SECONDS = float(os.getenv("THROTTLE_DEDUP_SECONDS", "1.5"))
+throttle = ThrottleMiddleware(THROTTLE_LIMITS, dedup_window=THROTTLE_DEDUP_SECONDS)
+dp.message.middleware(throttle)
+dp.callback_query.middleware(throttle)
+setup_dispatcher_metrics(dp)
+
+# Профилирование без перезапуска: /prof для админов (ADMIN_IDS через запятую) и сигналы
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SECONDS = int(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "600"))
+PROFILE_SIGNALS = parse_signal_mapping(os.getenv("PROFILE_SIGNALS", "USR1:tasks,USR2:cpu"))
+profiler = Profiler(PROFILE_DIR)
+
+# json - весь файл в памяти, compact - то же, но игроки в памяти столбцами (model.ChatColumns),
+# snapshot - бинарный снимок (snapshot.py), чаты читаются из mmap по мере обращения,
+# chatdir - файл на чат, в памяти LRU недавних чатов,
+# journal - журнал изменений + снимки, sqlite - база с точечными запросами.
+# CHAT_CACHE_SIZE - сколько чатов держит chatdir и сколько таблиц лидеров - /top
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+DB_FILE = os.getenv("DB_FILE", "csgo_data.db")
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "csgo_data.snap")
+CHAT_DIR = os.getenv("CHAT_DIR", "chats")
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1000"))
+JOURNAL_FSYNC_MS = int(os.getenv("JOURNAL_FSYNC_MS", "50"))
+JOURNAL_FSYNC_RECORDS = int(os.getenv("JOURNAL_FSYNC_RECORDS", "100"))
+JOURNAL_COMPACT_RECORDS = int(os.getenv("JOURNAL_COMPACT_RECORDS", "50000"))
+if STORAGE_BACKEND == "journal":
+    store = JournalStore(
+        DATA_FILE,
+        fsync_interval=JOURNAL_FSYNC_MS / 1000,
+        fsync_records=JOURNAL_FSYNC_RECORDS,
+        compact_records=JOURNAL_COMPACT_RECORDS
+    )
+elif STORAGE_BACKEND == "sqlite":
+    if not os.path.exists(DB_FILE) and os.path.exists(DATA_FILE):
+        migrate_json_to_sqlite(DATA_FILE, DB_FILE)
+    store = SQLiteStore(DB_FILE)
+elif STORAGE_BACKEND == "snapshot":
+    store = SnapshotStore(SNAPSHOT_FILE, json_path=DATA_FILE, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD)
+elif STORAGE_BACKEND == "chatdir":
+    if not os.path.exists(CHAT_DIR) and os.path.exists(DATA_FILE):
+        split_json_to_chat_dir(DATA_FILE, CHAT_DIR)
+    store = ChatDirStore(CHAT_DIR, cache_size=CHAT_CACHE_SIZE, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD)
+elif STORAGE_BACKEND == "compact":
+    store = CompactStore(DATA_FILE, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD)
+else:
+    store = JsonStore(DATA_FILE, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD)
+instrument_store(store)
+
+# Блокировки на игрока ("player", chat_id, user_id)
+locks = KeyedLocks()
+leaderboards = ChatLeaderboards(store, cache_size=CHAT_CACHE_SIZE)
+# Сводка по всем чатам строится из хранилища процесса и его уведомлений. У шарда
+# в нём только свои чаты (или чужие изменения мимо уведомлений в общей SQLite),
+# поэтому в режиме нескольких шардов /globaltop и /profile выключены
+global_stats = GlobalStats(store) if SHARD_COUNT == 1 else None
+TOP_PAGE_SIZE = 10
+
+# Имена для топа: кэш + обновление из каждого входящего апдейта
+names = NameCache(bot)
+dp.message.outer_middleware(NameRefreshMiddleware(names))
+dp.callback_query.outer_middleware(NameRefreshMiddleware(names))
+
+# Кулдаун между матчами и уведомления о его окончании (/notify)
+COOLDOWN_HOURS = float(os.getenv("COOLDOWN_HOURS", "3"))
+COOLDOWN_SECONDS = int(COOLDOWN_HOURS * 3600)
+COOLDOWN_NOTIFY_FILE = os.getenv("COOLDOWN_NOTIFY_FILE", "cooldown_notify.json")
+cooldown_notifier = CooldownNotifier(bot, names, COOLDOWN_NOTIFY_FILE)
+
+# Самоудаляющиеся сообщения (помощь, кулдаун)
+SCHEDULED_DELETES_FILE = os.getenv("SCHEDULED_DELETES_FILE", "scheduled_deletes.json")
+deletes = DeleteScheduler(bot, SCHEDULED_DELETES_FILE)
+
+# file_id картинок кейсов и скинов после первой отправки; MEDIA_WARMUP_CHAT - служебный чат
+# для загрузки всех картинок при старте
+MEDIA_CACHE_FILE = os.getenv("MEDIA_CACHE_FILE", "media_cache.json")
+MEDIA_WARMUP_CHAT = os.getenv("MEDIA_WARMUP_CHAT")
+media = MediaCache(bot, MEDIA_CACHE_FILE)
+
+# Сезоны: раз в SEASON_DAYS дней (0 - только вручную через /season) очки всех чатов
+# сбрасываются (reset) или умножаются на SEASON_DECAY (decay), лучшие получают SEASON_REWARDS.
+# Пересчёт идёт в SEASON_WORKERS процессах season_worker.py (0 - в потоке бота)
+SEASON_DAYS = float(os.getenv("SEASON_DAYS", "0"))
+SEASON_RULES = {
+    "mode": os.getenv("SEASON_MODE", "decay"),
+    "decay": float(os.getenv("SEASON_DECAY", "0.5")),
+    "rewards": parse_rewards(os.getenv("SEASON_REWARDS", "1:500,2:300,3:100")),
+    "archive_top": int(os.getenv("SEASON_ARCHIVE_TOP", "10"))
+}
+seasons = SeasonRunner(
+    store, locks,
+    checkpoint_path=os.getenv("SEASON_CHECKPOINT_FILE", "season_checkpoint.json"),
+    archive_dir=os.getenv("SEASON_ARCHIVE_DIR", "seasons"),
+    chunk_size=int(os.getenv("SEASON_CHUNK_SIZE", "200")),
+    workers=int(os.getenv("SEASON_WORKERS", "2")),
+    # Шарды на общей базе SQLite видят все чаты, каждый закрывает сезон только у своих
+    owns=lambda chat_id: shard_of(chat_id, SHARD_COUNT) == SHARD_INDEX
+)
+season_scheduler = SeasonScheduler(seasons, SEASON_RULES, SEASON_DAYS)
+
+# Выгрузка игроков и сводок по чатам для анализа (/export), файлы кладутся в EXPORT_DIR
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+
 # --- Константы ---
 WIN_CHANCE = 60
 DRAW_CHANCE = 5
 LOSE_CHANCE = 100 - WIN_CHANCE - DRAW_CHANCE
+# Сколько очков даёт победа и забирает поражение (от и до включительно)
+WIN_POINTS = (1, 15)
+LOSE_POINTS = (1, 10)
 
-PROMO_FILE = "promo_codes.json"
+PROMO_FILE = os.getenv("PROMO_FILE", "promo_codes.json")
+PROMO_LOG_FILE = os.getenv("PROMO_LOG_FILE", "promo_redemptions.jsonl")
 
 SKINS = {
     "AK-47 | Красная линия": {"rarity": "uncommon", "price": 126, "image": "https://i.postimg.cc/FzDYdG7v/Chat-GPT-Image-28-2025-20-43-48.png"},
@@ -97,33 +269,9 @@ for case_id, case_data in CASES.items():
         if skin not in SKINS:
             logging.error(f"❌ В кейсе '{case_data['name']}' указан несуществующий скин: '{skin}'")
 
-def load_promo_codes():
-    try:
-        if os.path.exists(PROMO_FILE):
-            with open(PROMO_FILE, "r") as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        logging.error(f"Ошибка загрузки промокодов: {e}")
-        return {}
-
-def save_promo_codes(promo_codes):
-    try:
-        with open(PROMO_FILE, "w") as f:
-            json.dump(promo_codes, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logging.error(f"Ошибка сохранения промокодов: {e}")
-
-def is_promo_valid(promo_info):
-    if not promo_info:
-        return False
-    if promo_info.get("expires"):
-        try:
-            expire_date = datetime.strptime(promo_info["expires"], "%Y-%m-%d").date()
-            return datetime.now().date() <= expire_date
-        except:
-            return False
-    return True
+# Таблицы выпадения собираются один раз при старте
+CASE_SAMPLERS = compile_case_samplers(CASES, SKINS, RARITY_PROBABILITIES)
+OPEN_BULK_MAX = 50
 
 RANKS = {
     0: "Silver 1",
@@ -194,62 +342,11 @@ DRAW_PHRASES = [
     "Фигня, давай по новой."
 ]
 
-PROMO_CODES = {
-    "CSGO2025": {
-        "points": 60,
-        "max_uses": 1500,
-        "used": 0,
-        "used_by": []
-    },
-    "HEADSHOT": {
-        "points": 55,
-        "max_uses": 350,
-        "used": 0,
-        "used_by": []
-    },
-    "SASAPIDR": {
-        "points": 520,
-        "max_uses": 1,
-        "used": 0,
-        "used_by": []
-    },
-    "HENDAYGOVNO": {
-        "points": 500,
-        "max_uses": 10,
-        "used": 0,
-        "used_by": []
-    },
-    "HENDAYbolsheneGOVNO": {
-        "points": 500,
-        "max_uses": 10,
-        "used": 0,
-        "used_by": []
-    },
-    
-    "TURKFUNK": {
-        "points": 500,
-        "max_uses": 10,
-        "used": 0,
-        "used_by": []
-    },
-     "nastoyachiykalkhoznick": {
-        "points": 40,
-        "max_uses": 6,
-        "used": 0,
-        "used_by": []
-      },
-     "javascriptonelove": {
-        "points": 69,
-        "max_uses": 16,
-        "used": 0,
-        "used_by": []
-         },
-     "iagruzinsukabliat": {
-        "points": 3,
-        "max_uses": 16,
-        "used": 0,
-        "used_by": []
-    }
+PROMO_ERRORS = {
+    "unknown": "❌ Неверный промокод",
+    "expired": "⌛ Срок действия промокода истёк",
+    "used": "⚠️ Вы уже использовали этот промокод!",
+    "exhausted": "⚠️ Лимит активаций исчерпан"
 }
 
 # --- Вспомогательная функция удаления сообщений ---
@@ -257,8 +354,8 @@ async def safe_delete(chat_id, message_id):
     """Удаляет сообщение, игнорируя ошибки если уже удалено"""
     try:
         await bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception:
-        pass
+    except Exception as e:
+        SWALLOWED_ERRORS.inc(where="safe_delete", error=type(e).__name__)
 
 # --- Клавиатуры ---
 def get_team_keyboard():
@@ -296,24 +393,17 @@ def get_cases_menu():
     buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-# --- Функции работы с данными ---
-def load_data():
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r") as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        logging.error(f"Ошибка загрузки данных: {e}")
-        return {}
-
-def save_data(data):
-    try:
-        with open(DATA_FILE, "w") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logging.error(f"Ошибка сохранения данных: {e}")
+def get_top_keyboard(page, total):
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"top_page_{page - 1}"))
+    if (page + 1) * TOP_PAGE_SIZE < total:
+        buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"top_page_{page + 1}"))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
 
+# --- Функции работы с данными ---
 def get_next_rank(wins):
     sorted_ranks = sorted(RANKS.items())
     for i, (threshold, rank) in enumerate(sorted_ranks):
@@ -327,18 +417,6 @@ def format_timedelta(delta: timedelta) -> str:
     minutes = remainder // 60
     return f"{hours}ч {minutes}м"
 
-def save_promo_uses():
-    data = load_data()
-    data["promo_uses"] = PROMO_CODES
-    save_data(data)
-
-def load_promo_uses():
-    data = load_data()
-    if "promo_uses" in data:
-        for code in PROMO_CODES:
-            if code in data["promo_uses"]:
-                PROMO_CODES[code]["used"] = data["promo_uses"][code]["used"]
-                PROMO_CODES[code]["used_by"] = data["promo_uses"][code].get("used_by", [])
 
 # --- Обработчики ---
 async def is_group_chat(message: Union[types.Message, types.CallbackQuery]):
@@ -355,11 +433,11 @@ async def start(message: types.Message):
         return
     await message.answer("🎮 <b>CS:GO Match Bot</b>", reply_markup=get_main_menu(), parse_mode="HTML")
 
-@dp.message(Command('help'))
+@dp.message(Command('help'), flags={"throttle": "menu"})
 async def help_command(message: types.Message):
     await help_handler(message)
 
-@dp.message(Command('promo'))
+@dp.message(Command('promo'), flags={"throttle": "promo"})
 async def promo_handler(message: types.Message):
     if message.chat.type == 'private':
         await message.answer("ℹ️ Промокоды активируются только в группах!")
@@ -371,56 +449,57 @@ async def promo_handler(message: types.Message):
         await message.reply("❌ Укажите промокод: /promo КОД")
         return
 
-    if promo_code not in PROMO_CODES:
-        await message.reply("❌ Неверный промокод")
-        return
-
     user_id = str(message.from_user.id)
-
-    if user_id in PROMO_CODES[promo_code]["used_by"]:
-        await message.reply("⚠️ Вы уже использовали этот промокод!")
-        return
-
-    if PROMO_CODES[promo_code]["used"] >= PROMO_CODES[promo_code]["max_uses"]:
-        await message.reply("⚠️ Лимит активаций исчерпан")
-        return
-
     chat_id = str(message.chat.id)
-    bonus = PROMO_CODES[promo_code]["points"]
-
-    data = load_data()
-    if chat_id not in data:
-        data[chat_id] = {"players": {}}
-    if user_id not in data[chat_id]["players"]:
-        data[chat_id]["players"][user_id] = {"points": 0, "wins": 0}
 
-    data[chat_id]["players"][user_id]["points"] += bonus
-    PROMO_CODES[promo_code]["used"] += 1
-    PROMO_CODES[promo_code]["used_by"].append(user_id)
+    # Проверка и списание активации атомарны внутри журнала промокодов
+    # Запись в журнал (или запрос к координатору шардов) - блокирующая, уводим из цикла событий
+    status, bonus, uses_left = await asyncio.to_thread(promo_ledger.redeem, promo_code, user_id, chat_id)
+    if status != "ok":
+        OUTCOMES.inc(outcome="promo_rejected")
+        await message.reply(PROMO_ERRORS[status])
+        return
+    OUTCOMES.inc(outcome="promo_redeemed")
 
-    save_data(data)
-    save_promo_uses()
+    await credit_promo(chat_id, user_id, promo_code, bonus)
 
     await message.reply(
         f"🎉 Промокод активирован!\n"
         f"+{bonus} очков\n"
-        f"Осталось активаций: {PROMO_CODES[promo_code]['max_uses'] - PROMO_CODES[promo_code]['used']}\n"
+        f"Осталось активаций: {uses_left}\n"
         f"⚠️ Вы больше не сможете использовать этот промокод!"
     )
 
-@dp.message(Command('t'))
+async def credit_promo(chat_id, user_id, promo_code, bonus):
+    """Начисляет бонус промокода и подтверждает активацию в журнале"""
+    async with locks.hold("player", chat_id, user_id):
+        player = store.get_player(chat_id, user_id) or {"points": 0, "wins": 0}
+        player["points"] += bonus
+        store.put_player(chat_id, user_id, player, reason="promo")
+        await asyncio.to_thread(promo_ledger.confirm, promo_code, user_id)
+
+async def restore_pending_promos():
+    """Доначисляет активации, записанные в журнал, но не дошедшие до игрока"""
+    for record in await asyncio.to_thread(promo_ledger.pending):
+        # Каждый шард доначисляет только своим чатам
+        if shard_of(record["chat"], SHARD_COUNT) != SHARD_INDEX:
+            continue
+        logging.warning(f"Доначисление промокода {record['code']} игроку {record['user']} в чате {record['chat']}")
+        await credit_promo(record["chat"], record["user"], record["code"], record["points"])
+
+@dp.message(Command('t'), flags={"throttle": "play"})
 async def choose_t(message: types.Message):
     if not await is_group_chat(message):
         return
     await process_team_choice(message, "Terrorists")
 
-@dp.message(Command('ct'))
+@dp.message(Command('ct'), flags={"throttle": "play"})
 async def choose_ct(message: types.Message):
     if not await is_group_chat(message):
         return
     await process_team_choice(message, "Counter-Terrorists")
 
-@dp.message(F.text == "🎮 Сыграть матч")
+@dp.message(F.text == "🎮 Сыграть матч", flags={"throttle": "play"})
 async def play_handler(message: types.Message):
     if not await is_group_chat(message):
         return
@@ -428,7 +507,7 @@ async def play_handler(message: types.Message):
     await safe_delete(message.chat.id, message.message_id)
     await message.answer("Выберите команду:", reply_markup=get_choice_menu())
 
-@dp.message(F.text.in_(["💣 Террористы", "🛡️ Спецназ"]))
+@dp.message(F.text.in_(["💣 Террористы", "🛡️ Спецназ"]), flags={"throttle": "play"})
 async def team_handler(message: types.Message):
     if not await is_group_chat(message):
         return
@@ -437,7 +516,7 @@ async def team_handler(message: types.Message):
     team = "Terrorists" if message.text == "💣 Террористы" else "Counter-Terrorists"
     await process_team_choice(message, team)
 
-@dp.message(F.text == "🔙 Назад")
+@dp.message(F.text == "🔙 Назад", flags={"throttle": "menu"})
 async def back_handler(message: types.Message):
     if not await is_group_chat(message):
         return
@@ -445,38 +524,29 @@ async def back_handler(message: types.Message):
     await safe_delete(message.chat.id, message.message_id)
     await message.answer("Главное меню:", reply_markup=get_main_menu())
 
-@dp.message(Command('stats'))
-@dp.message(F.text == "📊 Моя статистика")
+@dp.message(Command('stats'), flags={"throttle": "stats"})
+@dp.message(F.text == "📊 Моя статистика", flags={"throttle": "stats"})
 async def show_stats(message: types.Message):
     if not await is_group_chat(message):
         return
     # Удаляем сообщение пользователя
     await safe_delete(message.chat.id, message.message_id)
 
-    data = load_data()
     chat_id = str(message.chat.id)
     user_id = str(message.from_user.id)
 
-    if chat_id not in data or user_id not in data[chat_id].get("players", {}):
+    player = store.get_player(chat_id, user_id)
+    if player is None:
         await message.answer("Вы еще не играли в этом чате!", reply_markup=get_main_menu())
         return
 
-    player = data[chat_id]["players"][user_id]
     wins = player.get("wins", 0)
     points = player.get("points", 0)
     rank, wins_needed = get_next_rank(wins)
 
-    last_play = player.get("last_play")
-    if last_play:
-        try:
-            last_play_dt = datetime.fromisoformat(last_play)
-            time_left = timedelta(hours=10) - (datetime.now() - last_play_dt)
-            if time_left.total_seconds() > 0:
-                cooldown = f"⏳ До следующей игры: {format_timedelta(time_left)}"
-            else:
-                cooldown = "✅ Можно играть сейчас"
-        except:
-            cooldown = "⏳ Время кулдауна неизвестно"
+    time_left = get_cooldown_left(player)
+    if time_left is not None:
+        cooldown = f"⏳ До следующей игры: {format_timedelta(time_left)}"
     else:
         cooldown = "✅ Можно играть сейчас"
 
@@ -492,7 +562,76 @@ async def show_stats(message: types.Message):
         parse_mode="HTML"
     )
 
-@dp.message(F.text == "❓ Помощь")
+@dp.message(Command('notify'), flags={"throttle": "settings"})
+async def notify_handler(message: types.Message):
+    if not await is_group_chat(message):
+        return
+
+    chat_id = str(message.chat.id)
+    user_id = str(message.from_user.id)
+
+    async with locks.hold("player", chat_id, user_id):
+        player = store.get_player(chat_id, user_id)
+        if player is not None:
+            player["notify"] = not player.get("notify")
+            store.put_player(chat_id, user_id, player, reason="settings")
+
+    if player is None:
+        await message.reply("Вы еще не играли в этом чате!")
+        return
+
+    if player["notify"]:
+        if get_cooldown_left(player) is not None:
+            cooldown_notifier.add(chat_id, user_id, player["last_play"] + COOLDOWN_SECONDS)
+        await message.reply("🔔 Уведомления включены: бот напишет, когда можно будет сыграть снова")
+    else:
+        cooldown_notifier.remove(chat_id, user_id)
+        await message.reply("🔕 Уведомления выключены")
+
+@dp.message(Command('prof'))
+async def prof_handler(message: types.Message):
+    # Для остальных команды как будто нет
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    args = message.text.split()[1:]
+    mode = args[0].lower() if args else ""
+
+    if mode == "cpu":
+        try:
+            seconds = int(args[1]) if len(args) > 1 else PROFILE_SECONDS
+        except ValueError:
+            seconds = 0
+        if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+            await message.reply(f"❌ Длительность от 1 до {PROFILE_MAX_SECONDS} секунд")
+            return
+
+        async def on_done(path, summary):
+            await message.reply(f"✅ Профиль CPU: {path}\n{summary}")
+
+        if not profiler.start_cpu(seconds, on_done=on_done):
+            await message.reply("⏳ Профиль CPU уже снимается")
+            return
+        await message.reply(f"⏱ Снимаю профиль CPU {seconds} с...")
+    elif mode == "tasks":
+        path, waiting = profiler.dump_tasks()
+        text = f"📋 Стеки задач: {path}\n\n"
+        text += "\n".join(f"{count} × {place}" for place, count in waiting)
+        await message.reply(text)
+    elif mode == "mem":
+        path, top = profiler.toggle_memory()
+        if path is None:
+            await message.reply("🧠 tracemalloc включён. Повторите /prof mem, чтобы снять разницу")
+            return
+        await message.reply(f"🧠 Разница памяти: {path}\n\n" + "\n".join(top))
+    else:
+        await message.reply(
+            "/prof cpu [секунд] — профиль cProfile\n"
+            "/prof tasks — стеки asyncio-задач\n"
+            "/prof mem — включить tracemalloc / снять разницу"
+        )
+
+@dp.message(F.text == "❓ Помощь", flags={"throttle": "menu"})
 async def help_handler(message: types.Message):
     if not await is_group_chat(message):
         return
@@ -507,17 +646,21 @@ async def help_handler(message: types.Message):
         "• /ct или кнопка 🛡️ Спецназ - играть за спецназ\n"
         "• /stats или кнопка 📊 Моя статистика - ваша статистика\n"
         "• /promo и промокод- ввод промокода\n"
+        "• /notify - сообщить, когда можно сыграть снова\n"
         "• /top или кнопка 🏆 Топ игроков - топ игроков чата\n"
-        "• /open или кнопка 🎁 Открыть кейс - открыть кейс со скинами\n\n"
+        "• /globaltop - топ игроков по всем чатам\n"
+        "• /profile - ваша статистика по всем чатам\n"
+        "• /open или кнопка 🎁 Открыть кейс - открыть кейс со скинами\n"
+        "• /open fire x10 - открыть сразу несколько кейсов\n\n"
         "<b>Как играть:</b>\n"
         "1. Выберите команду (Террористы/Спецназ)\n"
         "2. Бот определит результат матча\n"
         "3. Получайте очки и повышайте ранг\n"
-        "4. Играть можно 1 раз в 10 часов в каждом чате\n\n"
+        f"4. Играть можно 1 раз в {COOLDOWN_HOURS:g} ч. в каждом чате\n\n"
         "<b>Система рангов:</b>\n"
         "• Ранги от Silver 1 до Challenger💎\n"
-        "• За победы получаете очки (1-15 за победу)\n"
-        "• За поражения теряете очки (1-10 за поражение)\n"
+        f"• За победы получаете очки ({WIN_POINTS[0]}-{WIN_POINTS[1]} за победу)\n"
+        f"• За поражения теряете очки ({LOSE_POINTS[0]}-{LOSE_POINTS[1]} за поражение)\n"
         "• Ничья не изменяет количество очков\n\n"
         "<b>Система кейсов:</b>\n"
         "• Можно открывать кейсы за очки\n"
@@ -527,64 +670,311 @@ async def help_handler(message: types.Message):
 
     # Помощь удаляется через 30 секунд
     sent = await message.answer(help_text, reply_markup=get_main_menu(), parse_mode="HTML")
-    await asyncio.sleep(30)
-    await safe_delete(message.chat.id, sent.message_id)
+    deletes.schedule(message.chat.id, sent.message_id, 30)
 
-@dp.message(Command('top'))
-@dp.message(F.text == "🏆 Топ игроков")
+@dp.message(Command('top'), flags={"throttle": "top"})
+@dp.message(F.text == "🏆 Топ игроков", flags={"throttle": "top"})
 async def show_top(message: types.Message):
     if not await is_group_chat(message):
         return
     # Удаляем сообщение пользователя
     await safe_delete(message.chat.id, message.message_id)
 
-    data = load_data()
     chat_id = str(message.chat.id)
+    user_id = str(message.from_user.id)
 
-    if chat_id not in data or not data[chat_id].get("players"):
+    board = leaderboards.get(chat_id)
+    if not len(board):
         await message.answer("В этом чате еще никто не играл!", reply_markup=get_main_menu())
         return
 
-    players = sorted(
-        data[chat_id]["players"].items(),
-        key=lambda x: (x[1].get("wins", 0), x[1].get("points", 0)),
-        reverse=True
-    )[:10]
+    top_text = await build_top_text(chat_id, board, 0)
+    position = board.position(user_id)
+    if position:
+        top_text += f"\n📍 Ваше место: {position} из {len(board)}"
 
+    # Топ остаётся навсегда
+    pager = get_top_keyboard(0, len(board))
+    await message.answer(top_text, reply_markup=pager or get_main_menu(), parse_mode="HTML")
+    if pager is not None:
+        # У сообщения одна клавиатура: листалка встроена в топ, а главное меню
+        # отправляется отдельно и остаётся у пользователя после удаления сообщения
+        sent = await message.answer("📋 Главное меню", reply_markup=get_main_menu())
+        deletes.schedule(message.chat.id, sent.message_id, 5)
+
+@dp.callback_query(lambda c: c.data.startswith('top_page_'), flags={"throttle": "top"})
+async def process_top_page(callback_query: types.CallbackQuery):
+    chat_id = str(callback_query.message.chat.id)
+    user_id = str(callback_query.from_user.id)
+    try:
+        page = int(callback_query.data[9:])
+    except ValueError:
+        await callback_query.answer("❌ Такой страницы нет")
+        return
+
+    board = leaderboards.get(chat_id)
+    if not len(board):
+        await callback_query.answer("В этом чате еще никто не играл!")
+        return
+    # Топ мог уменьшиться с момента отправки - показываем ближайшую страницу
+    page = max(0, min(page, (len(board) - 1) // TOP_PAGE_SIZE))
+
+    top_text = await build_top_text(chat_id, board, page)
+    try:
+        await callback_query.message.edit_text(
+            top_text,
+            reply_markup=get_top_keyboard(page, len(board)),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logging.error(f"Ошибка перелистывания топа: {e}")
+
+    position = board.position(user_id)
+    await callback_query.answer(f"📍 Ваше место: {position} из {len(board)}" if position else None)
+
+async def build_top_text(chat_id, board, page):
     team = random.choice(["NAVI", "Virtus pro", "Gambit", "Faze"])
     top_text = f"🏆 {team} | <b>Топ игроков:</b>\n\n"
 
-    for i, (user_id, stats) in enumerate(players, 1):
-        try:
-            user = await bot.get_chat_member(chat_id, int(user_id))
-            name = f"{user.user.username}" if user.user.username else user.user.first_name
-        except Exception as e:
-            logging.error(f"Ошибка получения пользователя {user_id}: {e}")
-            name = stats.get("username", f"Игрок {user_id[-4:]}")
-
-        points = stats.get("points", 0)
-        wins = stats.get("wins", 0)
+    offset = page * TOP_PAGE_SIZE
+    rows = board.page(offset, TOP_PAGE_SIZE)
+    user_ids = [user_id for user_id, _, _ in rows]
+    stored_names = {}
+    for user_id in user_ids:
+        if names.get(user_id) is None:
+            stored_names[user_id] = (store.get_player(chat_id, user_id) or {}).get("username")
+    row_names = await names.resolve(chat_id, user_ids, stored_names)
+
+    for i, (user_id, wins, points) in enumerate(rows, offset + 1):
         rank = get_next_rank(wins)[0]
-        top_text += f"{i}. {name} - {points} очков | {wins} побед (ранг: {rank})\n"
+        top_text += f"{i}. {html.escape(row_names[user_id])} - {points} очков | {wins} побед (ранг: {rank})\n"
+
+    return top_text
+
+async def global_stats_unavailable(message):
+    if global_stats is not None:
+        return False
+    await message.answer("ℹ️ Статистика по всем чатам недоступна в режиме шардов", reply_markup=get_main_menu())
+    return True
+
+@dp.message(Command('globaltop'), flags={"throttle": "top"})
+async def show_global_top(message: types.Message):
+    if not await is_group_chat(message):
+        return
+    await safe_delete(message.chat.id, message.message_id)
+    if await global_stats_unavailable(message):
+        return
+
+    await global_stats.ensure_built()
+    if not len(global_stats):
+        await message.answer("Еще никто не играл!", reply_markup=get_main_menu())
+        return
+
+    top_text = "🌍 <b>Топ игроков по всем чатам:</b>\n\n"
+    for i, (user_id, wins, points, chats) in enumerate(global_stats.page(0, TOP_PAGE_SIZE), 1):
+        name = names.get(user_id) or global_stats.name(user_id) or f"Игрок {user_id}"
+        rank = get_next_rank(wins)[0]
+        top_text += f"{i}. {html.escape(name)} - {points} очков | {wins} побед | чатов: {chats} (ранг: {rank})\n"
+
+    profile = global_stats.profile(str(message.from_user.id))
+    if profile:
+        top_text += f"\n📍 Ваше место: {profile['position']} из {len(global_stats)}"
 
-    # Топ остаётся навсегда
     await message.answer(top_text, reply_markup=get_main_menu(), parse_mode="HTML")
 
-@dp.message(Command('open'))
-@dp.message(F.text == "🎁 Открыть кейс")
+@dp.message(Command('profile'), flags={"throttle": "top"})
+async def show_profile(message: types.Message):
+    if not await is_group_chat(message):
+        return
+    await safe_delete(message.chat.id, message.message_id)
+    if await global_stats_unavailable(message):
+        return
+
+    await global_stats.ensure_built()
+    profile = global_stats.profile(str(message.from_user.id))
+    if profile is None:
+        await message.answer("Вы еще нигде не играли!", reply_markup=get_main_menu())
+        return
+
+    rank, wins_needed = get_next_rank(profile["wins"])
+    await message.answer(
+        f"👤 <b>Профиль {html.escape(message.from_user.first_name)}</b>\n\n"
+        f"🏅 Ранг: {rank}\n"
+        f"🎯 Побед: {profile['wins']}\n"
+        f"⭐ Очки: {profile['points']}\n"
+        f"💬 Чатов: {profile['chats']}\n"
+        f"🌍 Место: {profile['position']} из {len(global_stats)}",
+        reply_markup=get_main_menu(),
+        parse_mode="HTML"
+    )
+
+@dp.message(Command('globalcheck'))
+async def global_check_handler(message: types.Message):
+    # Сверка глобальной сводки с пересчётом с нуля, только для админов
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    if await global_stats_unavailable(message):
+        return
+
+    mismatches = await global_stats.verify()
+    if not mismatches:
+        await message.reply(f"✅ Глобальная сводка сходится ({len(global_stats)} игроков)")
+        return
+
+    await global_stats.rebuild()
+    text = f"⚠️ Расхождений: {len(mismatches)}, сводка перестроена\n\n"
+    text += "\n".join(f"{user_id}: {current} → {expected}" for user_id, current, expected in mismatches[:10])
+    await message.reply(text)
+
+@dp.message(Command('season'))
+async def season_handler(message: types.Message):
+    # Ход смены сезона и ручной запуск, только для админов
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    args = message.text.split()[1:]
+    if args and args[0].lower() == "rollover":
+        season_id = args[1] if len(args) > 1 else time.strftime("manual-%Y%m%d-%H%M%S")
+        if not seasons.start(season_id, SEASON_RULES):
+            await message.reply("⏳ Смена сезона уже идёт или этот сезон уже закрыт")
+            return
+        await message.reply(f"🏁 Смена сезона {season_id} запущена")
+        return
+
+    progress = seasons.progress()
+    if progress is None:
+        await message.reply(
+            f"📅 Последний закрытый сезон: {seasons.state.get('last_completed') or 'нет'}\n"
+            "/season rollover [id] — закрыть сезон сейчас"
+        )
+        return
+    season_id, done, total = progress
+    state = "идёт" if seasons.running else "прервана, продолжится при запуске"
+    await message.reply(f"🏁 Смена сезона {season_id} {state}: {done} из {total} чатов")
+
+@dp.message(Command('export'))
+async def export_handler(message: types.Message):
+    # Выгрузка всех чатов в файлы на сервере, только для админов
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    args = message.text.split()[1:]
+    fmt = args[0].lower() if args else "csv"
+    if fmt not in ("csv", "ndjson"):
+        await message.reply("/export [csv|ndjson] — выгрузить игроков и сводки по чатам")
+        return
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    players_path = os.path.join(EXPORT_DIR, f"players-{stamp}.{fmt}")
+    chats_path = os.path.join(EXPORT_DIR, f"chats-{stamp}.{fmt}")
+    await message.reply("📤 Выгрузка началась...")
+    started = time.perf_counter()
+    try:
+        chats, rows = await asyncio.to_thread(export_files, store, players_path, chats_path, fmt)
+    except Exception as e:
+        logging.error(f"Ошибка выгрузки: {e}")
+        await message.reply(f"❌ Ошибка выгрузки: {e}")
+        return
+    await message.reply(
+        f"✅ {rows} игроков из {chats} чатов за {time.perf_counter() - started:.1f} с\n"
+        f"{players_path}\n{chats_path}"
+    )
+
+@dp.message(Command('open'), flags={"throttle": "open"})
+@dp.message(F.text == "🎁 Открыть кейс", flags={"throttle": "open"})
 async def open_case_handler(message: types.Message):
     if not await is_group_chat(message):
         return
     # Удаляем сообщение пользователя
     await safe_delete(message.chat.id, message.message_id)
 
+    # /open кейс xN — открыть сразу несколько кейсов
+    args = message.text.split()[1:] if message.text.startswith("/") else []
+    if args:
+        await open_cases_bulk(message, args)
+        return
+
     await message.answer(
         "🎁 <b>Выберите кейс для открытия:</b>",
         reply_markup=get_cases_menu(),
         parse_mode="HTML"
     )
 
-@dp.callback_query(lambda c: c.data.startswith('case_'))
+def parse_open_args(args):
+    """Разбирает "fire x10" / "fire_case 10" в (case_id, количество)"""
+    case_id = args[0].lower()
+    if not case_id.endswith("_case"):
+        case_id += "_case"
+    try:
+        count = int(args[1].lower().lstrip("x")) if len(args) > 1 else 1
+    except ValueError:
+        return None, 0
+    if case_id not in CASES or not 1 <= count <= OPEN_BULK_MAX:
+        return None, 0
+    return case_id, count
+
+async def open_cases_bulk(message: types.Message, args):
+    case_id, count = parse_open_args(args)
+    if case_id is None:
+        cases_list = ", ".join(case_id[:-5] for case_id in CASES)
+        await message.answer(
+            f"❌ Формат: /open кейс xN (N от 1 до {OPEN_BULK_MAX})\n"
+            f"Например: /open fire x10\n"
+            f"Кейсы: {cases_list}"
+        )
+        return
+
+    case_data = CASES[case_id]
+    chat_id = str(message.chat.id)
+    user_id = str(message.from_user.id)
+    total_price = case_data["price"] * count
+
+    if case_id not in CASE_SAMPLERS:
+        await message.answer("❌ Ошибка: нет доступных скинов в кейсе")
+        return
+
+    # Все кейсы списываются и начисляются одной записью
+    async with locks.hold("player", chat_id, user_id):
+        player = store.get_player(chat_id, user_id)
+        if player is None:
+            error = "❌ Вы еще не играли в этом чате!"
+        elif player.get("points", 0) < total_price:
+            error = f"❌ Недостаточно очков! Нужно {total_price}"
+        else:
+            error = None
+            drops = CASE_SAMPLERS[case_id].sample_many(count)
+            payout = sum(SKINS[skin]["price"] for skin in drops)
+            player["points"] = player.get("points", 0) - total_price + payout
+            store.put_player(chat_id, user_id, player, reason="case_open")
+
+    if error:
+        await message.answer(error)
+        return
+    OUTCOMES.inc(count, outcome="case_opened")
+
+    drop_counts = {}
+    for skin in drops:
+        drop_counts[skin] = drop_counts.get(skin, 0) + 1
+    best_skin = max(drop_counts, key=lambda skin: SKINS[skin]["price"])
+
+    text = f"🎁 Открыто кейсов: {count} × {case_data['name']}\n\n"
+    for skin, skin_count in sorted(drop_counts.items(), key=lambda item: -SKINS[item[0]]["price"]):
+        text += f"🔫 <b>{skin}</b> ×{skin_count} ({SKINS[skin]['rarity']}, {SKINS[skin]['price']} очков)\n"
+    text += (
+        f"\n💳 Потрачено: {total_price} очков\n"
+        f"💵 Выпало на: {payout} очков\n"
+        f"💰 Баланс: {player['points']} очков"
+    )
+
+    # Результат — одно сообщение с картинкой самого дорогого скина
+    try:
+        await media.send_photo(message.chat.id, SKINS[best_skin]["image"], caption=text, parse_mode="HTML")
+    except Exception as e:
+        logging.error(f"Ошибка отправки изображения: {e}")
+        await bot.send_message(chat_id=message.chat.id, text=text, parse_mode="HTML")
+
+@dp.callback_query(lambda c: c.data.startswith('case_'), flags={"throttle": "open"})
 async def process_case_callback(callback_query: types.CallbackQuery):
     case_id = callback_query.data[5:]
     if case_id not in CASES:
@@ -595,12 +985,12 @@ async def process_case_callback(callback_query: types.CallbackQuery):
     user_id = str(callback_query.from_user.id)
     chat_id = str(callback_query.message.chat.id)
 
-    data = load_data()
-    if chat_id not in data or user_id not in data[chat_id]["players"]:
+    player = store.get_player(chat_id, user_id)
+    if player is None:
         await callback_query.answer("❌ Вы еще не играли в этом чате!")
         return
 
-    player_points = data[chat_id]["players"][user_id].get("points", 0)
+    player_points = player.get("points", 0)
     if player_points < case_data["price"]:
         await callback_query.answer(f"❌ Недостаточно очков! Нужно {case_data['price']}")
         return
@@ -609,86 +999,74 @@ async def process_case_callback(callback_query: types.CallbackQuery):
     await safe_delete(chat_id, callback_query.message.message_id)
 
     # Отправляем фото кейса с кнопкой "Открыть"
-    await bot.send_photo(
-        chat_id=callback_query.message.chat.id,
-        photo=case_data["image"],
-        caption=f"🎁 Вы выбрали: {case_data['name']}\n"
-                f"💳 Стоимость: {case_data['price']} очков\n\n"
-                f"Нажмите кнопку ниже, чтобы открыть кейс!",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔓 Открыть кейс", callback_data=f"open_{case_id}")]
-        ])
+    text = (
+        f"🎁 Вы выбрали: {case_data['name']}\n"
+        f"💳 Стоимость: {case_data['price']} очков\n\n"
+        f"Нажмите кнопку ниже, чтобы открыть кейс!"
     )
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔓 Открыть кейс", callback_data=f"open_{case_id}")]
+    ])
+    try:
+        await media.send_photo(callback_query.message.chat.id, case_data["image"], caption=text, reply_markup=keyboard)
+    except Exception as e:
+        logging.error(f"Ошибка отправки изображения: {e}")
+        await bot.send_message(chat_id=callback_query.message.chat.id, text=text, reply_markup=keyboard)
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith('open_'))
+@dp.callback_query(lambda c: c.data.startswith('open_'), flags={"throttle": "open"})
 async def process_open_case(callback_query: types.CallbackQuery):
     case_id = callback_query.data[5:]
     if case_id not in CASES:
         await callback_query.answer("❌ Такого кейса не существует")
         return
+    if case_id not in CASE_SAMPLERS:
+        await callback_query.answer("❌ Ошибка: нет доступных скинов в кейсе")
+        return
 
     case_data = CASES[case_id]
     user_id = str(callback_query.from_user.id)
     chat_id = str(callback_query.message.chat.id)
 
-    data = load_data()
-    if chat_id not in data or user_id not in data[chat_id]["players"]:
-        await callback_query.answer("❌ Вы еще не играли в этом чате!")
-        return
+    # Проверка баланса, списание и начисление — под блокировкой игрока, чтобы не было двойной траты
+    async with locks.hold("player", chat_id, user_id):
+        player = store.get_player(chat_id, user_id)
+        if player is None:
+            await callback_query.answer("❌ Вы еще не играли в этом чате!")
+            return
 
-    player_points = data[chat_id]["players"][user_id].get("points", 0)
-    if player_points < case_data["price"]:
-        await callback_query.answer(f"❌ Недостаточно очков! Нужно {case_data['price']}")
-        return
+        player_points = player.get("points", 0)
+        if player_points < case_data["price"]:
+            await callback_query.answer(f"❌ Недостаточно очков! Нужно {case_data['price']}")
+            return
 
-    # Удаляем фото кейса с кнопкой "Открыть"
-    await safe_delete(chat_id, callback_query.message.message_id)
-
-    # Вычитаем стоимость кейса
-    data[chat_id]["players"][user_id]["points"] -= case_data["price"]
-    save_data(data)
+        # Вычитаем стоимость кейса
+        player["points"] = player_points - case_data["price"]
+        store.put_player(chat_id, user_id, player, reason="case_buy")
 
-    # Выбираем скин с учетом редкости
-    possible_skins = case_data["contains"]
-    skins_with_rarity = []
+        # Выбираем скин с учетом редкости
+        selected_skin = CASE_SAMPLERS[case_id].sample()
+        skin_data = SKINS[selected_skin]
 
-    for skin in possible_skins:
-        try:
-            skin_data = SKINS[skin]
-            skins_with_rarity.append((skin, skin_data["rarity"]))
-        except KeyError:
-            logging.error(f"Скин '{skin}' не найден в SKINS!")
-            continue
+        # Добавляем стоимость скина к балансу
+        player["points"] += skin_data["price"]
+        store.put_player(chat_id, user_id, player, reason="skin_payout")
+    OUTCOMES.inc(outcome="case_opened")
 
-    if not skins_with_rarity:
-        await callback_query.answer("❌ Ошибка: нет доступных скинов в кейсе")
-        return
-
-    weights = [RARITY_PROBABILITIES[rarity] for _, rarity in skins_with_rarity]
-    selected_skin = random.choices(
-        population=[skin for skin, _ in skins_with_rarity],
-        weights=weights,
-        k=1
-    )[0]
-
-    skin_data = SKINS[selected_skin]
-
-    # Добавляем стоимость скина к балансу
-    data[chat_id]["players"][user_id]["points"] += skin_data["price"]
-    save_data(data)
+    # Удаляем фото кейса с кнопкой "Открыть"
+    await safe_delete(chat_id, callback_query.message.message_id)
 
     # Отправляем результат дропа — НЕ удаляется!
     try:
-        await bot.send_photo(
-            chat_id=callback_query.message.chat.id,
-            photo=skin_data["image"],
+        await media.send_photo(
+            callback_query.message.chat.id,
+            skin_data["image"],
             caption=f"🎉 Поздравляем! Вы получили:\n\n"
                     f"🔫 <b>{selected_skin}</b>\n"
                     f"🏷 Редкость: {skin_data['rarity']}\n"
                     f"💵 Стоимость: {skin_data['price']} очков\n\n"
                     f"💳 Потрачено: {case_data['price']} очков\n"
-                    f"💰 Баланс: {data[chat_id]['players'][user_id]['points']} очков",
+                    f"💰 Баланс: {player['points']} очков",
             parse_mode="HTML"
         )
     except Exception as e:
@@ -700,13 +1078,13 @@ async def process_open_case(callback_query: types.CallbackQuery):
                  f"🏷 Редкость: {skin_data['rarity']}\n"
                  f"💵 Стоимость: {skin_data['price']} очков\n\n"
                  f"💳 Потрачено: {case_data['price']} очков\n"
-                 f"💰 Баланс: {data[chat_id]['players'][user_id]['points']} очков",
+                 f"💰 Баланс: {player['points']} очков",
             parse_mode="HTML"
         )
 
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "back_to_main")
+@dp.callback_query(lambda c: c.data == "back_to_main", flags={"throttle": "menu"})
 async def back_to_main_menu(callback_query: types.CallbackQuery):
     # Удаляем сообщение с кнопками кейсов
     await safe_delete(callback_query.message.chat.id, callback_query.message.message_id)
@@ -717,38 +1095,60 @@ async def process_team_choice(message: types.Message, team: str):
     if not await is_group_chat(message):
         return
 
-    data = load_data()
     chat_id = str(message.chat.id)
     user_id = str(message.from_user.id)
 
-    if chat_id not in data:
-        data[chat_id] = {"players": {}}
-    if user_id not in data[chat_id]["players"]:
-        data[chat_id]["players"][user_id] = {
+    # Чтение, розыгрыш и запись — под блокировкой игрока; ответы отправляются уже без неё
+    async with locks.hold("player", chat_id, user_id):
+        player = store.get_player(chat_id, user_id) or {
             "wins": 0,
             "points": 0,
             "last_play": None,
         }
+        player["username"] = message.from_user.username or message.from_user.first_name
+
+        time_left = get_cooldown_left(player)
+        if time_left is None:
+            result, outcome = play_match(player, team)
+            player["last_play"] = int(time.time())
+            store.put_player(chat_id, user_id, player, reason="match")
+            if player.get("notify"):
+                cooldown_notifier.add(chat_id, user_id, player["last_play"] + COOLDOWN_SECONDS)
+
+    if time_left is not None:
+        OUTCOMES.inc(outcome="cooldown_rejected")
+        # Кулдаун удаляется через 10 секунд
+        sent = await message.answer(
+            f"⏳ До следующей игры осталось: {format_timedelta(time_left)}",
+            reply_markup=get_main_menu()
+        )
+        deletes.schedule(message.chat.id, sent.message_id, 10)
+        return
 
-    player = data[chat_id]["players"][user_id]
-    player["username"] = message.from_user.username or message.from_user.first_name
+    OUTCOMES.inc(outcome=result)
+    rank, wins_needed = get_next_rank(player["wins"])
 
-    if player.get("last_play"):
-        try:
-            last_play = datetime.fromisoformat(player["last_play"])
-            time_left = timedelta(hours=3) - (datetime.now() - last_play)
-            if time_left.total_seconds() > 0:
-                # Кулдаун удаляется через 10 секунд
-                sent = await message.answer(
-                    f"⏳ До следующей игры осталось: {format_timedelta(time_left)}",
-                    reply_markup=get_main_menu()
-                )
-                await asyncio.sleep(10)
-                await safe_delete(message.chat.id, sent.message_id)
-                return
-        except Exception as e:
-            logging.error(f"Ошибка проверки кулдауна: {e}")
+    # Результат матча — остаётся навсегда!
+    await message.answer(
+        f"{outcome}\n\n"
+        f"🏅 Текущий ранг: {rank}\n"
+        f"⭐ Очки: {player['points']}\n"
+        f"📈 До следующего ранга: {wins_needed} побед\n"
+        f"🎯 Побед: {player['wins']}",
+        reply_markup=get_main_menu()
+    )
 
+def get_cooldown_left(player):
+    """Сколько осталось до следующей игры, или None если играть можно"""
+    if not player.get("last_play"):
+        return None
+    seconds_left = player["last_play"] + COOLDOWN_SECONDS - time.time()
+    if seconds_left > 0:
+        return timedelta(seconds=seconds_left)
+    return None
+
+def play_match(player, team):
+    """Разыгрывает матч, меняет статистику игрока и возвращает (win/lose/draw, текст исхода)"""
     result = random.choices(
         ["win", "lose", "draw"],
         weights=[WIN_CHANCE, LOSE_CHANCE, DRAW_CHANCE],
@@ -758,13 +1158,13 @@ async def process_team_choice(message: types.Message, team: str):
     if result == "win":
         wins = player.get("wins", 0) + 1
         player["wins"] = wins
-        points = random.randint(1, 15)
+        points = random.randint(*WIN_POINTS)
         player["points"] += points
         rank, wins_needed = get_next_rank(wins)
         phrase = random.choice(WIN_PHRASES[team])
         outcome = f"{phrase}\nПобеда! +{points} очков 🏆\nНовый ранг: {rank}"
     elif result == "lose":
-        points = random.randint(1, 10)
+        points = random.randint(*LOSE_POINTS)
         player["points"] = max(0, player["points"] - points)
         phrase = random.choice(LOSE_PHRASES)
         outcome = f"{phrase}\nПоражение... -{points} очков 💀"
@@ -772,20 +1172,7 @@ async def process_team_choice(message: types.Message, team: str):
         phrase = random.choice(DRAW_PHRASES)
         outcome = f"{phrase}\nНичья! Очки не изменились ➖"
 
-    player["last_play"] = datetime.now().isoformat()
-    save_data(data)
-
-    rank, wins_needed = get_next_rank(player["wins"])
-
-    # Результат матча — остаётся навсегда!
-    await message.answer(
-        f"{outcome}\n\n"
-        f"🏅 Текущий ранг: {rank}\n"
-        f"⭐ Очки: {player['points']}\n"
-        f"📈 До следующего ранга: {wins_needed} побед\n"
-        f"🎯 Побед: {player['wins']}",
-        reply_markup=get_main_menu()
-    )
+    return result, outcome
 
 @dp.message(F.new_chat_members)
 async def welcome_new_chat(message: types.Message):
@@ -798,17 +1185,21 @@ async def welcome_new_chat(message: types.Message):
                 "• /ct или кнопка 🛡️ Спецназ - играть за спецназ\n"
                 "• /stats или кнопка 📊 Моя статистика - ваша статистика\n"
                 "• /promo и промокод- ввод промокода\n"
+                "• /notify - сообщить, когда можно сыграть снова\n"
                 "• /top или кнопка 🏆 Топ игроков - топ игроков чата\n"
-                "• /open или кнопка 🎁 Открыть кейс - открыть кейс со скинами\n\n"
+                "• /globaltop - топ игроков по всем чатам\n"
+                "• /profile - ваша статистика по всем чатам\n"
+                "• /open или кнопка 🎁 Открыть кейс - открыть кейс со скинами\n"
+                "• /open fire x10 - открыть сразу несколько кейсов\n\n"
                 "<b>Как играть:</b>\n"
                 "1. Выберите команду (Террористы/Спецназ)\n"
                 "2. Бот определит результат матча\n"
                 "3. Получайте очки и повышайте ранг\n"
-                "4. Играть можно 1 раз в 10 часов в каждом чате\n\n"
+                f"4. Играть можно 1 раз в {COOLDOWN_HOURS:g} ч. в каждом чате\n\n"
                 "<b>Система рангов:</b>\n"
                 "• Ранги от Silver 1 до Challenger💎\n"
-                "• За победы получаете очки (1-15 за победу)\n"
-                "• За поражения теряете очки (1-10 за поражение)\n"
+                f"• За победы получаете очки ({WIN_POINTS[0]}-{WIN_POINTS[1]} за победу)\n"
+                f"• За поражения теряете очки ({LOSE_POINTS[0]}-{LOSE_POINTS[1]} за поражение)\n"
                 "• Ничья не изменяет количество очков\n\n"
                 "<b>Система кейсов:</b>\n"
                 "• Можно открывать кейсы за очки\n"
@@ -818,11 +1209,52 @@ async def welcome_new_chat(message: types.Message):
             await message.reply(welcome_text, reply_markup=get_main_menu(), parse_mode="HTML")
 
 # Инициализация при старте
-load_promo_uses()
-
-async def main():
+# В режиме шардов (sharding.py) промокоды ведёт фронт-процесс, воркер обращается к нему
+PROMO_COORDINATOR = os.getenv("PROMO_COORDINATOR")
+if PROMO_COORDINATOR:
+    promo_ledger = connect_promo_coordinator(PROMO_COORDINATOR, os.getenv("PROMO_COORDINATOR_KEY", ""))
+else:
+    promo_ledger = PromoLedger(PROMO_FILE, PROMO_LOG_FILE)
+    promo_ledger.load(legacy_uses=store.get_promo_uses())
+
+async def main(worker_queue=None):
     logging.basicConfig(level=logging.INFO)
-    await dp.start_polling(bot, skip_updates=True)
+    store.start()
+    await restore_pending_promos()
+    deletes.start()
+    cooldown_notifier.start()
+    season_scheduler.start()
+    profiler.install_signal_handlers(asyncio.get_running_loop(), PROFILE_SIGNALS, cpu_seconds=PROFILE_SECONDS)
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    warmup = None
+    if MEDIA_WARMUP_CHAT:
+        images = [case["image"] for case in CASES.values()] + [skin["image"] for skin in SKINS.values()]
+        warmup = asyncio.create_task(media.warm_up(int(MEDIA_WARMUP_CHAT), images))
+    try:
+        if worker_queue is not None:
+            await run_worker(bot, dp, worker_queue, max_in_flight=WEBHOOK_MAX_IN_FLIGHT)
+        elif BOT_MODE == "webhook":
+            await run_webhook(
+                bot, dp, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                public_url=WEBHOOK_URL,
+                max_in_flight=WEBHOOK_MAX_IN_FLIGHT
+            )
+        else:
+            await dp.start_polling(bot, skip_updates=True)
+    finally:
+        if warmup is not None:
+            warmup.cancel()
+        # Сбрасываем несохранённые изменения перед остановкой
+        await deletes.stop()
+        await cooldown_notifier.stop()
+        await season_scheduler.stop()
+        await outbox.close()
+        if not PROMO_COORDINATOR:
+            promo_ledger.close()
+        store.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == '__main__':
     asyncio.run(main())
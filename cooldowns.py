@@ -0,0 +1,126 @@
+import asyncio
+import heapq
+import html
+import json
+import logging
+import os
+import time
+
+
+# --- Уведомления "можно играть снова" ---
+class CooldownNotifier:
+    """Индекс окончаний кулдаунов для игроков, включивших уведомления.
+
+    Окончания лежат в куче по времени. Когда кулдауны истекают, игроки одного
+    чата получают одно общее сообщение. Очередь сохраняется в файл, чтобы
+    уведомления переживали перезапуск.
+    """
+
+    def __init__(self, bot, names, path, persist_interval=5.0):
+        self.bot = bot
+        self.names = names
+        self.path = path
+        self.persist_interval = persist_interval
+        self._heap = []
+        self._due = {}
+        self._dirty = False
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def add(self, chat_id, user_id, expires_at):
+        key = (str(chat_id), str(user_id))
+        self._due[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key[0], key[1]))
+        self._dirty = True
+        if self._heap[0][0] == expires_at:
+            self._wakeup.set()
+
+    def remove(self, chat_id, user_id):
+        # Запись в куче остаётся и пропускается при извлечении
+        if self._due.pop((str(chat_id), str(user_id)), None) is not None:
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._due)
+
+    # --- Сохранение очереди ---
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for chat_id, user_id, expires_at in json.load(f):
+                        self._due[(chat_id, user_id)] = expires_at
+                self._heap = [(expires_at, chat_id, user_id) for (chat_id, user_id), expires_at in self._due.items()]
+                heapq.heapify(self._heap)
+        except Exception as e:
+            logging.error(f"Ошибка загрузки уведомлений о кулдаунах: {e}")
+
+    def _save(self):
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([[chat_id, user_id, expires_at] for (chat_id, user_id), expires_at in self._due.items()], f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except Exception as e:
+            logging.error(f"Ошибка сохранения уведомлений о кулдаунах: {e}")
+
+    # --- Выполнение ---
+    def _pop_due(self):
+        now = time.time()
+        by_chat = {}
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, chat_id, user_id = heapq.heappop(self._heap)
+            if self._due.get((chat_id, user_id)) != expires_at:
+                continue
+            del self._due[(chat_id, user_id)]
+            by_chat.setdefault(chat_id, []).append(user_id)
+        if by_chat:
+            self._dirty = True
+        return by_chat
+
+    async def _notify(self, chat_id, user_ids):
+        mentions = ", ".join(
+            f'<a href="tg://user?id={user_id}">{html.escape(self.names.get(user_id) or f"Игрок {user_id[-4:]}")}</a>'
+            for user_id in user_ids
+        )
+        try:
+            await self.bot.send_message(
+                chat_id=int(chat_id),
+                text=f"🔔 Можно снова играть: {mentions}",
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            logging.warning(f"Не удалось отправить уведомление в чат {chat_id}: {e}")
+
+    async def _run(self):
+        while True:
+            by_chat = self._pop_due()
+            if by_chat:
+                await asyncio.gather(*(self._notify(chat_id, user_ids) for chat_id, user_ids in by_chat.items()))
+            if self._dirty:
+                self._save()
+
+            self._wakeup.clear()
+            timeout = self.persist_interval
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._load()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._save()
@@ -0,0 +1,149 @@
+"""Выгрузка игроков и сводок по чатам в CSV или NDJSON для анализа экономики.
+
+Чаты читаются из хранилища по одному (store.scan_players) и сразу пишутся в файл,
+поэтому в памяти одновременно лежит только один чат, а блокировка хранилища
+держится не дольше чтения одного чата - выгрузку можно делать на живом боте (/export).
+
+    python export.py --backend json --path csgo_data.json --output players.csv --chats-output chats.csv
+    python export.py --backend chatdir --path chats --format ndjson --output - | gzip > players.ndjson.gz
+"""
+
+import csv
+import json
+import os
+import sys
+import time
+
+PLAYER_FIELDS = ("chat_id", "user_id", "username", "wins", "points", "last_play", "notify")
+CHAT_FIELDS = (
+    "chat_id", "players", "wins_total", "points_total", "points_mean",
+    "points_min", "points_p25", "points_median", "points_p75", "points_p90", "points_max",
+    "active_1d", "active_7d", "active_30d", "never_played", "last_activity"
+)
+ACTIVITY_WINDOWS = (("active_1d", 86400), ("active_7d", 7 * 86400), ("active_30d", 30 * 86400))
+
+
+# --- Конвейер ---
+def iter_chats(store):
+    """(chat_id, {user_id: игрок}) по одному чату; пустые чаты пропускаются"""
+    for chat_id in store.chat_ids():
+        players = store.scan_players(chat_id)
+        if players:
+            yield chat_id, players
+
+
+def player_rows(chat_id, players):
+    for user_id, player in players.items():
+        yield {
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "username": player.get("username"),
+            "wins": player.get("wins", 0),
+            "points": player.get("points", 0),
+            "last_play": player.get("last_play"),
+            "notify": bool(player.get("notify"))
+        }
+
+
+def percentile(ordered, fraction):
+    """Ближайший ранг в отсортированном списке"""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def chat_summary(chat_id, players, now):
+    points = sorted(player.get("points", 0) for player in players.values())
+    plays = [player["last_play"] for player in players.values() if player.get("last_play") is not None]
+    summary = {
+        "chat_id": chat_id,
+        "players": len(players),
+        "wins_total": sum(player.get("wins", 0) for player in players.values()),
+        "points_total": sum(points),
+        "points_mean": round(sum(points) / len(points), 2),
+        "points_min": points[0],
+        "points_p25": percentile(points, 0.25),
+        "points_median": percentile(points, 0.5),
+        "points_p75": percentile(points, 0.75),
+        "points_p90": percentile(points, 0.9),
+        "points_max": points[-1],
+        "never_played": len(players) - len(plays),
+        "last_activity": max(plays) if plays else None
+    }
+    for name, window in ACTIVITY_WINDOWS:
+        summary[name] = sum(1 for last_play in plays if now - last_play <= window)
+    return summary
+
+
+# --- Запись ---
+def row_writer(f, fmt, fields):
+    """Функция записи одной строки-словаря в открытый текстовый файл"""
+    if fmt == "ndjson":
+        return lambda row: f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    writer = csv.DictWriter(f, fieldnames=fields)
+    writer.writeheader()
+    return writer.writerow
+
+
+def export(store, output, chats_output=None, fmt="csv", now=None):
+    """Пишет игроков в output и, если задан chats_output, сводки чатов. Возвращает (чатов, игроков)"""
+    now = int(time.time()) if now is None else now
+    write_player = row_writer(output, fmt, PLAYER_FIELDS)
+    write_chat = row_writer(chats_output, fmt, CHAT_FIELDS) if chats_output is not None else None
+    chats = rows = 0
+    for chat_id, players in iter_chats(store):
+        for row in player_rows(chat_id, players):
+            write_player(row)
+            rows += 1
+        if write_chat is not None:
+            write_chat(chat_summary(chat_id, players, now))
+        chats += 1
+    return chats, rows
+
+
+def export_files(store, path, chats_path=None, fmt="csv"):
+    """То же в файлы. Пишет во временные файлы и переименовывает, чтобы не оставлять обрывков"""
+    paths = [path] + ([chats_path] if chats_path else [])
+    files = [open(f"{file_path}.tmp", "w", encoding="utf-8", newline="") for file_path in paths]
+    try:
+        result = export(store, files[0], files[1] if chats_path else None, fmt)
+    finally:
+        for f in files:
+            f.close()
+    for file_path in paths:
+        os.replace(f"{file_path}.tmp", file_path)
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    from storage import ChatDirStore, CompactStore, JournalStore, JsonStore, SnapshotStore, SQLiteStore
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Выгрузка игроков и сводок по чатам")
+    parser.add_argument("--backend", default="json", choices=["json", "compact", "snapshot", "chatdir", "journal", "sqlite"])
+    parser.add_argument("--path", default="csgo_data.json")
+    parser.add_argument("--format", default="csv", choices=["csv", "ndjson"])
+    parser.add_argument("--output", default="-", help="файл игроков, - для stdout")
+    parser.add_argument("--chats-output", help="файл сводок по чатам")
+    args = parser.parse_args()
+
+    store = {
+        "json": JsonStore, "compact": CompactStore, "snapshot": SnapshotStore, "chatdir": ChatDirStore,
+        "journal": JournalStore, "sqlite": SQLiteStore
+    }[args.backend](args.path)
+    started = time.perf_counter()
+    try:
+        if args.output == "-":
+            chats_file = open(args.chats_output, "w", encoding="utf-8", newline="") if args.chats_output else None
+            try:
+                chats, rows = export(store, sys.stdout, chats_file, args.format)
+            finally:
+                if chats_file is not None:
+                    chats_file.close()
+        else:
+            chats, rows = export_files(store, args.output, args.chats_output, args.format)
+    finally:
+        # Только чтение: close() сбросил бы и сжал данные работающего бота
+        store.release()
+    print(f"Выгружено {rows} игроков из {chats} чатов за {time.perf_counter() - started:.1f} с", file=sys.stderr)
@@ -0,0 +1,355 @@
+import asyncio
+import logging
+import random
+from collections import OrderedDict
+
+
+# --- Индексируемый skip list ---
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankedSkipList:
+    """Упорядоченное множество ключей со вставкой, удалением, поиском места и срезом за O(log n)"""
+
+    MAX_LEVELS = 32
+
+    def __init__(self):
+        self._tail = _Node(None, 0)
+        self._head = _Node(None, self.MAX_LEVELS)
+        self._head.next = [self._tail] * self.MAX_LEVELS
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _random_levels(self):
+        levels = 1
+        while levels < self.MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, key):
+        chain = [None] * self.MAX_LEVELS
+        steps_at_level = [0] * self.MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_levels()
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain = [None] * self.MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key):
+        """Позиция ключа (с нуля)"""
+        position = 0
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        if node.next[0] is self._tail or node.next[0].key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start, count):
+        """count ключей начиная с позиции start"""
+        if start < 0 or start >= self._size or count <= 0:
+            return []
+        remaining = start + 1
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not self._tail and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+# --- Таблица лидеров ---
+class Leaderboard:
+    """Игроки, упорядоченные по (победы, очки) по убыванию"""
+
+    def __init__(self):
+        self._ranking = RankedSkipList()
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._ranking)
+
+    def update(self, user_id, wins, points):
+        key = (-wins, -points, user_id)
+        old_key = self._keys.get(user_id)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._ranking.remove(old_key)
+        self._ranking.insert(key)
+        self._keys[user_id] = key
+
+    def discard(self, user_id):
+        old_key = self._keys.pop(user_id, None)
+        if old_key is not None:
+            self._ranking.remove(old_key)
+
+    def position(self, user_id):
+        """Место игрока (с единицы) или None"""
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return self._ranking.index(key) + 1
+
+    def page(self, offset, limit):
+        """Список (user_id, wins, points) начиная с места offset + 1"""
+        return [(user_id, -wins, -points) for wins, points, user_id in self._ranking.slice(offset, limit)]
+
+
+class ChatLeaderboards:
+    """Таблицы лидеров по чатам. Строятся из хранилища при первом обращении
+    и дальше обновляются по уведомлениям об изменении игроков. В памяти не больше
+    cache_size таблиц (LRU), и таблица чата выбрасывается вместе с чатом, когда
+    хранилище вытесняет его из своего кэша"""
+
+    def __init__(self, store, cache_size=1000):
+        self._store = store
+        self.cache_size = cache_size
+        self._boards = OrderedDict()
+        store.add_listener(self._on_player_changed)
+        store.add_evict_listener(self._on_chat_evicted)
+
+    def get(self, chat_id):
+        board = self._boards.get(chat_id)
+        if board is not None:
+            self._boards.move_to_end(chat_id)
+        else:
+            board = Leaderboard()
+            for user_id, player in self._store.get_players(chat_id).items():
+                board.update(user_id, player.get("wins", 0), player.get("points", 0))
+            # Пустую таблицу не храним: первый игрок чата придёт в неё при следующем обращении
+            if len(board):
+                self._boards[chat_id] = board
+                while len(self._boards) > self.cache_size:
+                    self._boards.popitem(last=False)
+        return board
+
+    def _on_player_changed(self, chat_id, user_id, player):
+        board = self._boards.get(chat_id)
+        if board is not None:
+            board.update(user_id, player.get("wins", 0), player.get("points", 0))
+
+    def _on_chat_evicted(self, chat_id):
+        self._boards.pop(chat_id, None)
+
+
+# --- Сводка по всем чатам ---
+def scan_global(store):
+    """Сводка с нуля: ({(chat_id, user_id): (wins, points)}, {user_id: имя}). Читает все чаты"""
+    contributions = {}
+    names = {}
+    for chat_id in store.chat_ids():
+        for user_id, player in store.scan_players(chat_id).items():
+            contributions[(chat_id, user_id)] = (player.get("wins", 0), player.get("points", 0))
+            if player.get("username"):
+                names[user_id] = player["username"]
+    return contributions, names
+
+
+def sum_contributions(contributions):
+    """{user_id: [wins, points, chats]}"""
+    totals = {}
+    for (_, user_id), (wins, points) in contributions.items():
+        total = totals.setdefault(user_id, [0, 0, 0])
+        total[0] += wins
+        total[1] += points
+        total[2] += 1
+    return totals
+
+
+class GlobalStats:
+    """Победы, очки и число чатов каждого игрока по всем чатам, с общим рейтингом.
+
+    Один раз строится полным проходом по хранилищу (в потоке, при первом обращении),
+    дальше обновляется по уведомлениям хранилища: вклад игрока в чат заменяется
+    новым, итог меняется на разницу. Изменения, пришедшие во время построения,
+    проигрываются после него - они абсолютные, поэтому повтор безопасен.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._board = None
+        self._totals = {}
+        self._contributions = {}
+        self._names = {}
+        self._pending = None
+        self._building = None
+        store.add_listener(self._on_player_changed)
+
+    @property
+    def ready(self):
+        return self._board is not None
+
+    async def ensure_built(self):
+        if self._board is not None:
+            return
+        if self._building is None:
+            self._building = asyncio.create_task(self._build())
+        await asyncio.shield(self._building)
+
+    async def _build(self):
+        self._pending = []
+        try:
+            contributions, names = await asyncio.to_thread(scan_global, self._store)
+        except BaseException:
+            # Следующее обращение начнёт построение заново, а изменения не копятся впустую
+            self._pending = None
+            self._building = None
+            raise
+        self._load(contributions, names)
+        logging.info(f"Глобальная сводка построена: {len(self._totals)} игроков")
+
+    def _load(self, contributions, names):
+        self._contributions = contributions
+        self._names = names
+        self._totals = sum_contributions(contributions)
+        self._board = Leaderboard()
+        for user_id, (wins, points, _) in self._totals.items():
+            self._board.update(user_id, wins, points)
+        pending, self._pending = self._pending, None
+        for event in pending:
+            self._apply(*event)
+
+    def _on_player_changed(self, chat_id, user_id, player):
+        event = (chat_id, user_id, player.get("wins", 0), player.get("points", 0), player.get("username"))
+        # Пока идёт проход по хранилищу, изменения копятся, чтобы проиграть их поверх результата
+        if self._pending is not None:
+            self._pending.append(event)
+        if self._board is not None:
+            self._apply(*event)
+
+    def _apply(self, chat_id, user_id, wins, points, username):
+        total = self._totals.setdefault(user_id, [0, 0, 0])
+        old = self._contributions.get((chat_id, user_id))
+        if old is None:
+            total[2] += 1
+        else:
+            total[0] -= old[0]
+            total[1] -= old[1]
+        total[0] += wins
+        total[1] += points
+        self._contributions[(chat_id, user_id)] = (wins, points)
+        if username:
+            self._names[user_id] = username
+        self._board.update(user_id, total[0], total[1])
+
+    # --- Запросы ---
+    def __len__(self):
+        return len(self._board) if self._board is not None else 0
+
+    def name(self, user_id):
+        return self._names.get(user_id)
+
+    def page(self, offset, limit):
+        """Список (user_id, wins, points, chats) начиная с места offset + 1"""
+        return [
+            (user_id, wins, points, self._totals[user_id][2])
+            for user_id, wins, points in self._board.page(offset, limit)
+        ]
+
+    def profile(self, user_id):
+        """{"wins", "points", "chats", "position"} или None, если игрок нигде не играл"""
+        total = self._totals.get(user_id)
+        if total is None:
+            return None
+        wins, points, chats = total
+        return {"wins": wins, "points": points, "chats": chats, "position": self._board.position(user_id)}
+
+    # --- Проверка ---
+    async def verify(self):
+        """Сверяет сводку с построенной заново. Возвращает [(user_id, сейчас, заново)] расхождений"""
+        await self.ensure_built()
+        contributions, _ = await asyncio.to_thread(scan_global, self._store)
+        fresh = sum_contributions(contributions)
+        mismatches = []
+        for user_id in self._totals.keys() | fresh.keys():
+            current = self._totals.get(user_id)
+            expected = fresh.get(user_id)
+            if current != expected:
+                mismatches.append((user_id, current, expected))
+        return mismatches
+
+    async def rebuild(self):
+        """Строит сводку заново, не останавливая обновления"""
+        self._pending = []
+        try:
+            contributions, names = await asyncio.to_thread(scan_global, self._store)
+        except BaseException:
+            # Старая сводка остаётся и дальше обновляется по уведомлениям
+            self._pending = None
+            raise
+        self._load(contributions, names)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from storage import ChatDirStore, CompactStore, JournalStore, JsonStore, SnapshotStore, SQLiteStore
+
+    parser = argparse.ArgumentParser(description="Глобальный топ, построенный с нуля по файлам данных")
+    parser.add_argument("--backend", default="json", choices=["json", "compact", "snapshot", "chatdir", "journal", "sqlite"])
+    parser.add_argument("--path", default="csgo_data.json")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    store = {
+        "json": JsonStore, "compact": CompactStore, "snapshot": SnapshotStore, "chatdir": ChatDirStore,
+        "journal": JournalStore, "sqlite": SQLiteStore
+    }[args.backend](args.path)
+    contributions, names = scan_global(store)
+    store.release()
+    totals = sum_contributions(contributions)
+    board = Leaderboard()
+    for user_id, (wins, points, _) in totals.items():
+        board.update(user_id, wins, points)
+    print(f"Игроков: {len(board)}, записей по чатам: {len(contributions)}")
+    for place, (user_id, wins, points) in enumerate(board.page(0, args.limit), 1):
+        print(f"{place:4}. {names.get(user_id, user_id)} - {points} очков | {wins} побед | чатов: {totals[user_id][2]}")
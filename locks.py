@@ -0,0 +1,41 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from metrics import Gauge, Histogram
+
+LOCK_WAIT = Histogram("bot_lock_wait_seconds", "Время ожидания блокировки по ключу", ["kind"])
+LOCKS_ACTIVE = Gauge("bot_locks_active", "Количество ключей, по которым сейчас есть блокировки")
+
+
+# --- Блокировки по ключу ---
+class KeyedLocks:
+    """Отдельный asyncio.Lock на каждый ключ (игрок, промокод).
+
+    Блокировки создаются при первом обращении и удаляются, как только
+    их никто не держит и не ждёт, поэтому разные игроки не мешают друг другу.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, *key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+            LOCKS_ACTIVE.set(len(self._locks))
+        entry[1] += 1
+        started = time.monotonic()
+        try:
+            async with entry[0]:
+                LOCK_WAIT.observe(time.monotonic() - started, kind=key[0])
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+                LOCKS_ACTIVE.set(len(self._locks))
+
+    def __len__(self):
+        return len(self._locks)
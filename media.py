@@ -0,0 +1,97 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+
+
+class MediaUnavailable(Exception):
+    """Картинка недавно не загрузилась - повторять отправку по URL нет смысла"""
+
+
+# --- Кэш file_id картинок ---
+class MediaCache:
+    """Запоминает file_id, который Telegram вернул при первой удачной отправке картинки,
+    и дальше шлёт его вместо внешнего URL: Telegram не скачивает файл заново.
+
+    URL, которые не загрузились, помнятся broken_ttl секунд: в это время send_photo
+    сразу бросает MediaUnavailable, и вызывающий код отправляет текст без картинки.
+    """
+
+    def __init__(self, bot, path, broken_ttl=3600.0):
+        self.bot = bot
+        self.path = path
+        self.broken_ttl = broken_ttl
+        self._file_ids = self._load()
+        self._broken = {}
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.error(f"Ошибка загрузки кэша картинок: {e}")
+        return {}
+
+    def _save(self):
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._file_ids, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения кэша картинок: {e}")
+
+    def __contains__(self, url):
+        return url in self._file_ids
+
+    def _remember(self, url, message):
+        if message.photo:
+            self._file_ids[url] = message.photo[-1].file_id
+            self._broken.pop(url, None)
+            self._save()
+
+    async def send_photo(self, chat_id, url, **kwargs):
+        file_id = self._file_ids.get(url)
+        if file_id is not None:
+            try:
+                return await self.bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                # file_id мог устареть (например, у бота сменился токен) - пробуем по URL
+                logging.warning(f"file_id для {url} не принят: {e}")
+                del self._file_ids[url]
+                self._save()
+
+        broken_at = self._broken.get(url)
+        if broken_at is not None and time.monotonic() - broken_at < self.broken_ttl:
+            raise MediaUnavailable(f"картинка недавно не загрузилась: {url}")
+        try:
+            message = await self.bot.send_photo(chat_id=chat_id, photo=url, **kwargs)
+        except TelegramBadRequest:
+            self._broken[url] = time.monotonic()
+            raise
+        self._remember(url, message)
+        return message
+
+    async def warm_up(self, chat_id, urls, delay=1.0):
+        """Один раз загружает в служебный чат все картинки, которых ещё нет в кэше"""
+        loaded = failed = 0
+        for url in dict.fromkeys(urls):
+            if url in self._file_ids:
+                continue
+            try:
+                message = await self.send_photo(chat_id, url, disable_notification=True)
+            except Exception as e:
+                logging.warning(f"Не удалось прогреть картинку {url}: {e}")
+                failed += 1
+                continue
+            loaded += 1
+            try:
+                await self.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+            except Exception:
+                pass
+            await asyncio.sleep(delay)
+        logging.info(f"Прогрев картинок: загружено {loaded}, с ошибкой {failed}, в кэше {len(self._file_ids)}")
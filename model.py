@@ -0,0 +1,280 @@
+"""Компактное представление игроков.
+
+Хранилища отдают игроков словарями {"wins", "points", "last_play", "username", "notify"}
+со строковыми id - так удобно обработчикам, но в памяти это сотни байт на игрока.
+Здесь две плотные раскладки с целочисленными id и last_play в секундах эпохи:
+
+- Player - запись со __slots__;
+- ChatColumns - столбцы одного чата в array и индекс user_id -> номер строки.
+
+Формат сериализации ChatColumns (все числа little-endian):
+
+    заголовок   4s  магия b"CCOL"
+                H   версия формата (1)
+                I   n - число игроков
+    столбцы     q[n] user_id
+                i[n] wins
+                q[n] points
+                q[n] last_play (-1 - ещё не играл)
+                B[n] notify (0/1)
+    имена       I[n+1] смещения в блоке имён; пустой диапазон - имени нет
+                       (имя нулевой длины не отличается от отсутствующего)
+                ...    имена в UTF-8 подряд
+
+Замер памяти: python model.py measure --players 1000000
+(1M игроков по 100 в чате, CPython 3.11: словари с ISO-временем ~454 байт/игрок,
+словари с секундами ~422, Player ~328, ChatColumns ~180 - из них больше половины
+приходится на строки имён и индекс id -> строка)
+"""
+
+import argparse
+import random
+import struct
+import sys
+import tracemalloc
+from array import array
+
+NO_TIME = -1
+
+HEADER = struct.Struct("<4sHI")
+MAGIC = b"CCOL"
+VERSION = 1
+
+
+# --- Запись со слотами ---
+class Player:
+    __slots__ = ("user_id", "wins", "points", "last_play", "username", "notify")
+
+    def __init__(self, user_id, wins=0, points=0, last_play=None, username=None, notify=False):
+        self.user_id = user_id
+        self.wins = wins
+        self.points = points
+        self.last_play = last_play
+        self.username = username
+        self.notify = notify
+
+    @classmethod
+    def from_dict(cls, user_id, player):
+        return cls(
+            int(user_id),
+            player.get("wins", 0),
+            player.get("points", 0),
+            player.get("last_play"),
+            player.get("username"),
+            bool(player.get("notify"))
+        )
+
+    def to_dict(self):
+        """Словарь в том виде, в каком его отдают хранилища"""
+        player = {"wins": self.wins, "points": self.points}
+        if self.last_play is not None:
+            player["last_play"] = self.last_play
+        if self.username is not None:
+            player["username"] = self.username
+        if self.notify:
+            player["notify"] = True
+        return player
+
+    def __repr__(self):
+        return f"Player({self.user_id}, wins={self.wins}, points={self.points})"
+
+
+# --- Столбцы одного чата ---
+class ChatColumns:
+    """Игроки одного чата по столбцам. Строки только добавляются, порядок - порядок появления"""
+
+    __slots__ = ("user_ids", "wins", "points", "last_play", "notify", "usernames", "_rows")
+
+    def __init__(self):
+        self.user_ids = array("q")
+        self.wins = array("i")
+        self.points = array("q")
+        self.last_play = array("q")
+        self.notify = array("B")
+        self.usernames = []
+        self._rows = {}
+
+    @classmethod
+    def from_players(cls, players):
+        """Из словаря {user_id: словарь игрока}"""
+        columns = cls()
+        for user_id, player in players.items():
+            columns.put(user_id, player)
+        return columns
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        return int(user_id) in self._rows
+
+    def _player(self, row):
+        player = {"wins": self.wins[row], "points": self.points[row]}
+        if self.last_play[row] != NO_TIME:
+            player["last_play"] = self.last_play[row]
+        if self.usernames[row] is not None:
+            player["username"] = self.usernames[row]
+        if self.notify[row]:
+            player["notify"] = True
+        return player
+
+    def get(self, user_id):
+        row = self._rows.get(int(user_id))
+        return None if row is None else self._player(row)
+
+    def record(self, user_id):
+        row = self._rows.get(int(user_id))
+        if row is None:
+            return None
+        return Player(int(user_id), **self._player(row))
+
+    def put(self, user_id, player):
+        user_id = int(user_id)
+        last_play = player.get("last_play")
+        values = (
+            player.get("wins", 0),
+            player.get("points", 0),
+            NO_TIME if last_play is None else last_play,
+            int(bool(player.get("notify")))
+        )
+        row = self._rows.get(user_id)
+        if row is None:
+            self._rows[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.wins.append(values[0])
+            self.points.append(values[1])
+            self.last_play.append(values[2])
+            self.notify.append(values[3])
+            self.usernames.append(player.get("username"))
+        else:
+            self.wins[row], self.points[row], self.last_play[row], self.notify[row] = values
+            self.usernames[row] = player.get("username")
+
+    def items(self):
+        """(user_id строкой, словарь игрока) - как ключи в остальных хранилищах"""
+        for row, user_id in enumerate(self.user_ids):
+            yield str(user_id), self._player(row)
+
+    def to_players(self):
+        return dict(self.items())
+
+    # --- Сериализация ---
+    def to_bytes(self):
+        names = []
+        offsets = array("I", [0])
+        for username in self.usernames:
+            encoded = username.encode("utf-8") if username else b""
+            names.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+        parts = [HEADER.pack(MAGIC, VERSION, len(self))]
+        for column in (self.user_ids, self.wins, self.points, self.last_play, self.notify, offsets):
+            if sys.byteorder == "big":
+                column = array(column.typecode, column)
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.extend(names)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Обратно из to_bytes. Принимает bytes или memoryview (например, срез mmap)"""
+        data = memoryview(data)
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Неизвестный формат столбцов: {bytes(magic)!r} v{version}")
+        columns = cls()
+        position = HEADER.size
+        for name, typecode, length in (
+            ("user_ids", "q", count), ("wins", "i", count), ("points", "q", count),
+            ("last_play", "q", count), ("notify", "B", count), (None, "I", count + 1)
+        ):
+            column = array(typecode)
+            size = column.itemsize * length
+            column.frombytes(data[position:position + size])
+            if sys.byteorder == "big":
+                column.byteswap()
+            position += size
+            if name is None:
+                offsets = column
+            else:
+                setattr(columns, name, column)
+        names = data[position:]
+        columns.usernames = [
+            bytes(names[start:end]).decode("utf-8") if end > start else None
+            for start, end in zip(offsets, offsets[1:])
+        ]
+        columns._rows = {user_id: row for row, user_id in enumerate(columns.user_ids)}
+        return columns
+
+
+# --- Замер памяти ---
+def synthetic_players(players, players_per_chat, seed=1):
+    """Поток (chat_id, user_id, словарь игрока) в текущем виде: строковые id, last_play в секундах"""
+    rng = random.Random(seed)
+    for index in range(players):
+        yield str(-1000000000000 - index // players_per_chat), str(100000000 + index), {
+            "wins": rng.randint(0, 500),
+            "points": rng.randint(0, 20000),
+            "last_play": 1700000000 + rng.randint(0, 10 ** 7),
+            "username": f"player{index}"
+        }
+
+
+def build_dicts(stream, iso=False):
+    from datetime import datetime
+
+    data = {}
+    for chat_id, user_id, player in stream:
+        if iso:
+            player["last_play"] = datetime.fromtimestamp(player["last_play"]).isoformat()
+        data.setdefault(chat_id, {"players": {}})["players"][user_id] = player
+    return data
+
+
+def build_records(stream):
+    data = {}
+    for chat_id, user_id, player in stream:
+        data.setdefault(int(chat_id), {})[int(user_id)] = Player.from_dict(user_id, player)
+    return data
+
+
+def build_columns(stream):
+    data = {}
+    for chat_id, user_id, player in stream:
+        columns = data.get(chat_id)
+        if columns is None:
+            columns = data[chat_id] = ChatColumns()
+        columns.put(user_id, player)
+    return {int(chat_id): columns for chat_id, columns in data.items()}
+
+
+def measure(players, players_per_chat):
+    """Сколько памяти остаётся занятой после построения каждой раскладки (tracemalloc)"""
+    layouts = {
+        "dict, ISO last_play (было)": lambda stream: build_dicts(stream, iso=True),
+        "dict, epoch last_play (сейчас)": build_dicts,
+        "Player со __slots__": build_records,
+        "ChatColumns": build_columns,
+    }
+    results = {}
+    for name, build in layouts.items():
+        tracemalloc.start()
+        layout = build(synthetic_players(players, players_per_chat))
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del layout
+        results[name] = size
+        print(f"{name:32} {size / 2 ** 20:9.1f} МиБ  {size / players:7.1f} байт/игрок")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Компактное представление игроков")
+    commands = parser.add_subparsers(dest="command", required=True)
+    measure_parser = commands.add_parser("measure", help="сравнить расход памяти раскладок")
+    measure_parser.add_argument("--players", type=int, default=1000000)
+    measure_parser.add_argument("--players-per-chat", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.command == "measure":
+        measure(args.players, args.players_per_chat)
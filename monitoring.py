@@ -0,0 +1,89 @@
+import functools
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from metrics import Counter, Histogram
+
+UPDATES = Counter("bot_updates_total", "Входящих апдейтов", ["type"])
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время работы обработчика", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключений в обработчиках", ["handler"])
+OUTCOMES = Counter(
+    "bot_outcomes_total",
+    "Исходы действий игроков: win, lose, draw, case_opened, promo_redeemed, promo_rejected, cooldown_rejected",
+    ["outcome"]
+)
+STORAGE_LATENCY = Histogram(
+    "bot_storage_seconds", "Время операций хранилища", ["op"],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+API_LATENCY = Histogram("bot_telegram_request_seconds", "Время запроса к Telegram API", ["method"])
+API_ERRORS = Counter("bot_telegram_errors_total", "Ошибок запросов к Telegram API", ["method", "error"])
+SWALLOWED_ERRORS = Counter("bot_swallowed_errors_total", "Ошибок, которые бот сознательно проглотил", ["where", "error"])
+
+STORE_OPERATIONS = ("get_player", "get_players", "scan_players", "put_player", "chat_ids", "flush")
+
+
+# --- Апдейты и обработчики ---
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: считает апдейты по типу"""
+
+    async def __call__(self, handler, event, data):
+        UPDATES.inc(type=event.event_type)
+        return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время и ошибки каждого обработчика по имени функции"""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+
+
+def setup_dispatcher_metrics(dp):
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(HandlerMetricsMiddleware())
+
+
+# --- Запросы к Telegram ---
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки запросов к API. Подключается после SendQueue, чтобы не считать ожидание в очереди"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, method=name)
+
+
+# --- Хранилище ---
+def instrument_store(store):
+    """Оборачивает методы хранилища замером времени (включая сброс на диск в фоновом потоке)"""
+    for op in STORE_OPERATIONS:
+        method = getattr(store, op)
+
+        @functools.wraps(method)
+        def timed(*args, _method=method, _op=op, **kwargs):
+            started = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                STORAGE_LATENCY.observe(time.perf_counter() - started, op=_op)
+
+        setattr(store, op, timed)
+    return store
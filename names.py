@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+
+def display_name(user):
+    return user.username or user.first_name
+
+
+# --- Кэш отображаемых имён ---
+class NameCache:
+    """LRU-кэш имён игроков с TTL.
+
+    Имена берутся из from_user каждого апдейта и из username, сохранённого у игрока.
+    Остальные запрашиваются через get_chat_member параллельно, но не больше
+    concurrency запросов одновременно. Неудачные запросы и вышедшие из чата
+    игроки запоминаются на negative_ttl секунд, чтобы не дёргать API повторно.
+    """
+
+    def __init__(self, bot, ttl=6 * 3600, negative_ttl=1800, max_size=100000, concurrency=5):
+        self.bot = bot
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._names = OrderedDict()
+        self._missing = OrderedDict()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _put(self, cache, key, value, ttl):
+        cache[key] = (value, time.monotonic() + ttl)
+        cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+    def _get(self, cache, key):
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return entry
+
+    def remember(self, user_id, name):
+        if name:
+            self._put(self._names, user_id, name, self.ttl)
+
+    def get(self, user_id):
+        entry = self._get(self._names, user_id)
+        return entry[0] if entry else None
+
+    async def _fetch(self, chat_id, user_id):
+        async with self._semaphore:
+            try:
+                member = await self.bot.get_chat_member(int(chat_id), int(user_id))
+            except Exception as e:
+                logging.error(f"Ошибка получения пользователя {user_id}: {e}")
+                self._put(self._missing, (chat_id, user_id), True, self.negative_ttl)
+                return None
+        if member.status in ("left", "kicked"):
+            self._put(self._missing, (chat_id, user_id), True, self.negative_ttl)
+            return None
+        name = display_name(member.user)
+        self.remember(user_id, name)
+        return name
+
+    async def resolve(self, chat_id, user_ids, stored_names=None):
+        """Возвращает {user_id: имя} для всех user_ids"""
+        stored_names = stored_names or {}
+        names = {}
+        to_fetch = []
+        for user_id in user_ids:
+            name = self.get(user_id)
+            if name is None and stored_names.get(user_id):
+                name = stored_names[user_id]
+                self.remember(user_id, name)
+            if name is not None:
+                names[user_id] = name
+            elif self._get(self._missing, (chat_id, user_id)) is None:
+                to_fetch.append(user_id)
+
+        fetched = await asyncio.gather(*(self._fetch(chat_id, user_id) for user_id in to_fetch))
+        names.update(zip(to_fetch, fetched))
+
+        return {
+            user_id: names.get(user_id) or f"Игрок {user_id[-4:]}"
+            for user_id in user_ids
+        }
+
+
+class NameRefreshMiddleware(BaseMiddleware):
+    """Обновляет кэш имён по from_user каждого входящего апдейта"""
+
+    def __init__(self, names):
+        self.names = names
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, "from_user", None)
+        if user is not None and not user.is_bot:
+            self.names.remember(str(user.id), display_name(user))
+        return await handler(event, data)
@@ -0,0 +1,231 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery, DeleteMessage, DeleteMessages, EditMessageCaption, EditMessageReplyMarkup,
+    EditMessageText, SendMessage, SendPhoto
+)
+from aiogram.types import ReplyKeyboardMarkup
+
+from metrics import Counter, Gauge, Histogram
+
+QUEUE_DEPTH = Gauge("bot_outbox_queue_depth", "Запросов к Telegram в очереди на отправку")
+QUEUE_WAIT = Histogram("bot_outbox_wait_seconds", "Время ожидания в очереди на отправку", ["method"])
+COALESCED = Counter("bot_outbox_coalesced_total", "Одинаковых запросов, склеенных с уже стоящим в очереди", ["method"])
+RETRY_AFTER = Counter("bot_outbox_retry_after_total", "Ответов 429 (retry_after) от Telegram", ["method"])
+SHED = Counter("bot_outbox_shed_total", "Запросов, сброшенных из переполненной очереди", ["method"])
+
+
+class OutboxOverloaded(Exception):
+    """Очередь на отправку переполнена, и этот запрос вытеснен более важными"""
+
+
+# --- Ведро токенов ---
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд появится токен"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+# --- Очередь исходящих запросов ---
+class SendQueue(BaseRequestMiddleware):
+    """Пропускает отправки в Telegram через общий и початовый лимиты.
+
+    Ответы на нажатия кнопок идут первыми, потом сообщения, удаления — в последнюю
+    очередь. Початовый лимит Telegram касается только отправки и правки сообщений,
+    поэтому удаления и ответы на кнопки тратят лишь общий токен.
+
+    Одинаковые запросы из COALESCE (правки, удаления, повторное меню в тот же чат),
+    которые уже ждут в очереди, не дублируются: все вызвавшие получают один результат.
+    В очереди не больше max_waiting запросов: при переполнении вытесняется самый
+    новый из наименее важных, его вызвавший получает OutboxOverloaded.
+    На 429 запрос ждёт retry_after и повторяется сам. Остальные методы API
+    (getUpdates, getChatMember и т.п.) проходят мимо очереди.
+    """
+
+    PRIORITIES = {
+        AnswerCallbackQuery: 0,
+        SendMessage: 1,
+        SendPhoto: 1,
+        EditMessageText: 1,
+        EditMessageCaption: 1,
+        EditMessageReplyMarkup: 1,
+        DeleteMessage: 2,
+        DeleteMessages: 2,
+    }
+    CHAT_LIMITED = (SendMessage, SendPhoto, EditMessageText, EditMessageCaption, EditMessageReplyMarkup)
+    COALESCE = (EditMessageText, EditMessageCaption, EditMessageReplyMarkup, DeleteMessage, DeleteMessages)
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, global_rate=25.0, chat_rate=20 / 60, chat_burst=5, max_retries=3, max_waiting=10000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_waiting = max_waiting
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._waiting = []
+        self._pending = {}
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._pump_task = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    # --- Выдача разрешений на отправку ---
+    def _grant_ready(self):
+        """Отпускает все запросы, для которых есть токены. Возвращает, сколько ждать до следующей проверки"""
+        now = time.monotonic()
+        delay = 1.0
+        skipped = []
+        while self._waiting:
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                delay = global_delay
+                break
+            entry = heapq.heappop(self._waiting)
+            _, _, chat_id, future, _ = entry
+            if future.done():
+                continue
+            bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+            chat_delay = bucket.delay(now) if bucket is not None else 0.0
+            if chat_delay > 0:
+                skipped.append(entry)
+                delay = min(delay, chat_delay)
+                continue
+            self._global.take(now)
+            if bucket is not None:
+                bucket.take(now)
+            future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._waiting, entry)
+        QUEUE_DEPTH.set(len(self._waiting))
+        return delay
+
+    async def _pump(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._grant_ready()
+            try:
+                if self._waiting:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                else:
+                    await self._wakeup.wait()
+            except asyncio.TimeoutError:
+                pass
+
+    def _shed(self, entry):
+        """Освобождает место в полной очереди. False, если самый неважный - сам entry"""
+        worst = max(self._waiting)
+        if entry > worst:
+            SHED.inc(method=entry[4])
+            return False
+        self._waiting.remove(worst)
+        heapq.heapify(self._waiting)
+        SHED.inc(method=worst[4])
+        if not worst[3].done():
+            worst[3].set_exception(OutboxOverloaded(worst[4]))
+        return True
+
+    async def _acquire(self, priority, chat_id, name):
+        if self._pump_task is None:
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.create_task(self._pump())
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), chat_id, future, name)
+        if len(self._waiting) >= self.max_waiting and not self._shed(entry):
+            raise OutboxOverloaded(name)
+        heapq.heappush(self._waiting, entry)
+        QUEUE_DEPTH.set(len(self._waiting))
+        self._wakeup.set()
+        await future
+
+    # --- Отправка ---
+    async def _send(self, make_request, bot, method, priority):
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        # Удаления и ответы на кнопки не ждут початового лимита, только общий
+        bucket_chat = chat_id if isinstance(method, self.CHAT_LIMITED) else None
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            await self._acquire(priority, bucket_chat, name)
+            QUEUE_WAIT.observe(time.monotonic() - queued_at, method=name)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                RETRY_AFTER.inc(method=name)
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Флуд-лимит Telegram ({name}, чат {chat_id}), ждём {e.retry_after} с")
+                bucket = self._chat_bucket(bucket_chat) if bucket_chat is not None else self._global
+                bucket.pause(e.retry_after)
+
+    async def __call__(self, make_request, bot, method):
+        priority = self.PRIORITIES.get(type(method))
+        if priority is None:
+            return await make_request(bot, method)
+
+        if not self._coalescable(method):
+            return await self._send(make_request, bot, method, priority)
+
+        key = f"{type(method).__name__}:{method!r}"
+        task = self._pending.get(key)
+        if task is not None:
+            COALESCED.inc(method=type(method).__name__)
+        else:
+            task = asyncio.ensure_future(self._send(make_request, bot, method, priority))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    def _coalescable(self, method):
+        """Склеиваются только повторяемые без вреда запросы: правки, удаления и меню-клавиатуры"""
+        if isinstance(method, self.COALESCE):
+            return True
+        return isinstance(method, SendMessage) and isinstance(method.reply_markup, ReplyKeyboardMarkup)
+
+    async def close(self):
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+            self._pump_task = None
@@ -0,0 +1,146 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+from collections import Counter
+
+
+# --- Профилирование по запросу ---
+class Profiler:
+    """Снимает профили работающего бота без перезапуска. Пока профилирование
+    не запущено, ничего не делает и не стоит ничего.
+
+    cpu   - cProfile на N секунд (профилируется поток цикла событий)
+    tasks - стеки всех asyncio-задач и сводка, где они ждут
+    mem   - первый вызов включает tracemalloc и запоминает снимок,
+            второй пишет разницу и выключает трассировку
+    """
+
+    MODES = ("cpu", "tasks", "mem")
+
+    def __init__(self, output_dir="profiles", top=40):
+        self.output_dir = output_dir
+        self.top = top
+        self._cpu_task = None
+        self._memory_baseline = None
+
+    def _path(self, kind, extension):
+        os.makedirs(self.output_dir, exist_ok=True)
+        # pid в имени: воркеры шардов пишут в одинаковые каталоги
+        return os.path.join(self.output_dir, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{extension}")
+
+    # --- CPU ---
+    @property
+    def cpu_running(self):
+        return self._cpu_task is not None and not self._cpu_task.done()
+
+    def start_cpu(self, seconds, on_done=None):
+        """Запускает cProfile в фоне. on_done(путь, сводка) - корутина, вызывается по окончании"""
+        if self.cpu_running:
+            return False
+        self._cpu_task = asyncio.create_task(self._profile_cpu(seconds, on_done))
+        return True
+
+    async def _profile_cpu(self, seconds, on_done):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        path = self._path("cpu", "prof")
+        profile.dump_stats(path)
+
+        # Рядом - текстовая сводка, чтобы не нужен был pstats под рукой
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(self.top)
+        with open(path[:-len(".prof")] + ".txt", "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+        stats = pstats.Stats(profile)
+        summary = f"{stats.total_calls} вызовов за {seconds} с"
+        logging.info(f"Профиль CPU сохранён: {path} ({summary})")
+        if on_done is not None:
+            await on_done(path, summary)
+
+    # --- Задачи asyncio ---
+    def dump_tasks(self):
+        """Пишет стеки всех задач. Возвращает (путь, [(где ждут, сколько задач), ...])"""
+        tasks = asyncio.all_tasks()
+        waiting = Counter()
+        path = self._path("tasks", "txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"Задач: {len(tasks)}\n\n")
+            for task in tasks:
+                stack = task.get_stack()
+                if stack:
+                    frame = stack[-1]
+                    waiting[f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"] += 1
+                else:
+                    waiting["<выполняется>"] += 1
+                f.write(f"--- {task.get_name()}: {task.get_coro().__qualname__}\n")
+                task.print_stack(file=f)
+                f.write("\n")
+            f.write("Где ждут задачи:\n")
+            for place, count in waiting.most_common():
+                f.write(f"{count:6} {place}\n")
+        logging.info(f"Стеки задач сохранены: {path} ({len(tasks)} задач)")
+        return path, waiting.most_common(10)
+
+    # --- Память ---
+    def toggle_memory(self):
+        """Возвращает (None, None) при включении трассировки или (путь, [строки сводки]) при снятии разницы"""
+        if self._memory_baseline is None:
+            tracemalloc.start(25)
+            self._memory_baseline = tracemalloc.take_snapshot()
+            logging.info("tracemalloc включён, снимок для сравнения сохранён")
+            return None, None
+
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        differences = snapshot.compare_to(self._memory_baseline, "lineno")
+        self._memory_baseline = None
+        path = self._path("memory", "txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for difference in differences[:self.top * 5]:
+                f.write(f"{difference}\n")
+        logging.info(f"Разница снимков памяти сохранена: {path}")
+        return path, [str(difference) for difference in differences[:5]]
+
+    # --- Сигналы ---
+    def install_signal_handlers(self, loop, mapping, cpu_seconds=30):
+        """mapping: {"USR1": "tasks", "USR2": "cpu"}. На платформах без сигналов ничего не делает"""
+        for name, mode in mapping.items():
+            signum = getattr(signal, f"SIG{name}", None)
+            if signum is None or mode not in self.MODES:
+                logging.warning(f"Сигнал профилирования пропущен: SIG{name} -> {mode}")
+                continue
+            try:
+                loop.add_signal_handler(signum, self._on_signal, mode, cpu_seconds)
+            except (NotImplementedError, RuntimeError) as e:
+                logging.warning(f"Не удалось повесить обработчик SIG{name}: {e}")
+
+    def _on_signal(self, mode, cpu_seconds):
+        try:
+            if mode == "cpu":
+                if not self.start_cpu(cpu_seconds):
+                    logging.warning("Профиль CPU уже снимается")
+            elif mode == "tasks":
+                self.dump_tasks()
+            else:
+                self.toggle_memory()
+        except Exception as e:
+            logging.error(f"Ошибка профилирования ({mode}): {e}")
+
+
+def parse_signal_mapping(value):
+    """"USR1:tasks,USR2:cpu" -> {"USR1": "tasks", "USR2": "cpu"}"""
+    mapping = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, mode = item.partition(":")
+        mapping[name.strip().upper().removeprefix("SIG")] = mode.strip()
+    return mapping
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+
+def is_promo_valid(promo_info):
+    if not promo_info:
+        return False
+    if promo_info.get("expires"):
+        try:
+            expire_date = datetime.strptime(promo_info["expires"], "%Y-%m-%d").date()
+            return datetime.now().date() <= expire_date
+        except:
+            return False
+    return True
+
+
+# --- Промокоды ---
+class PromoLedger:
+    """Промокоды из promo_codes.json и журнал их активаций.
+
+    Файл с кодами перечитывается сам, если изменился (проверка не чаще раза
+    в reload_interval секунд). Активации лежат в множестве на каждый код,
+    а проверка и списание активации делаются атомарно в redeem().
+    Журнал активаций — отдельный файл, по строке JSON на событие.
+
+    Активация с указанным чатом сначала записывается как ожидающая, а после
+    начисления очков игроку подтверждается в confirm(). Ожидающие активации
+    (процесс упал между журналом и начислением) отдаёт pending().
+    """
+
+    def __init__(self, codes_path, log_path, reload_interval=5.0):
+        self.codes_path = codes_path
+        self.log_path = log_path
+        self.reload_interval = reload_interval
+        self.codes = {}
+        self._codes_mtime = None
+        self._checked_at = 0.0
+        self._used = {}
+        self._used_by = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self.reload()
+
+    # --- Коды ---
+    def reload(self):
+        """Перечитывает promo_codes.json. Коды не зависят от регистра"""
+        try:
+            mtime = os.path.getmtime(self.codes_path)
+            with open(self.codes_path, "r", encoding="utf-8") as f:
+                codes = {code.upper(): info for code, info in json.load(f).items()}
+        except Exception as e:
+            logging.error(f"Ошибка загрузки промокодов: {e}")
+            return False
+        with self._lock:
+            self.codes = codes
+            self._codes_mtime = mtime
+        logging.info(f"Загружено промокодов: {len(codes)}")
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.codes_path)
+        except OSError:
+            return
+        if mtime != self._codes_mtime:
+            self.reload()
+
+    # --- Журнал активаций ---
+    def load(self, legacy_uses=None):
+        """Восстанавливает активации из журнала. Если журнала ещё нет,
+        переносит в него старые активации из хранилища игроков"""
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logging.warning(f"Пропущена повреждённая запись в {self.log_path}")
+                        continue
+                    self._apply(record)
+            self._log = open(self.log_path, "a", encoding="utf-8")
+            return
+
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        for code, info in (legacy_uses or {}).items():
+            record = {"op": "seed", "code": code.upper(), "used": info.get("used", 0), "users": info.get("used_by", [])}
+            self._apply(record)
+            self._write(record)
+
+    def _apply(self, record):
+        code = record["code"]
+        used_by = self._used_by.setdefault(code, set())
+        if record["op"] == "seed":
+            used_by.update(record["users"])
+            self._used[code] = self._used.get(code, 0) + record["used"]
+        elif record["op"] == "redeem":
+            used_by.add(record["user"])
+            self._used[code] = self._used.get(code, 0) + 1
+            # Старые записи без чата начислялись сразу
+            if record.get("chat") is not None:
+                self._pending[(code, record["user"])] = record
+        elif record["op"] == "applied":
+            self._pending.pop((code, record["user"]), None)
+
+    def _write(self, record):
+        self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._log.flush()
+
+    # --- Активация ---
+    def redeem(self, code, user_id, chat_id=None):
+        """Проверяет и активирует код для игрока. С chat_id активация остаётся
+        ожидающей до confirm()
+
+        Возвращает (статус, бонус, осталось активаций), статус один из:
+        ok, unknown, expired, used, exhausted
+        """
+        self._maybe_reload()
+        with self._lock:
+            promo = self.codes.get(code)
+            if promo is None:
+                return "unknown", 0, 0
+            if not is_promo_valid(promo):
+                return "expired", 0, 0
+            used_by = self._used_by.setdefault(code, set())
+            if user_id in used_by:
+                return "used", 0, 0
+            used = self._used.get(code, 0)
+            if used >= promo["max_uses"]:
+                return "exhausted", 0, 0
+
+            record = {"op": "redeem", "code": code, "user": user_id, "at": int(time.time())}
+            if chat_id is not None:
+                record.update(chat=chat_id, points=promo["points"])
+            self._apply(record)
+            self._write(record)
+            return "ok", promo["points"], promo["max_uses"] - used - 1
+
+    def confirm(self, code, user_id):
+        """Отмечает, что очки за активацию начислены"""
+        with self._lock:
+            if (code, user_id) not in self._pending:
+                return
+            record = {"op": "applied", "code": code, "user": user_id}
+            self._apply(record)
+            self._write(record)
+
+    def pending(self):
+        """Активации, очки за которые ещё не начислены: [{code, user, chat, points}]"""
+        with self._lock:
+            return [
+                {"code": record["code"], "user": record["user"], "chat": record["chat"], "points": record["points"]}
+                for record in self._pending.values()
+            ]
+
+    def stats(self, code):
+        with self._lock:
+            return self._used.get(code, 0), len(self._used_by.get(code, ()))
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
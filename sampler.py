@@ -0,0 +1,46 @@
+import random
+
+
+# --- Выбор по весам за O(1) (метод Уолкера/Воуза) ---
+class AliasSampler:
+    """Таблица псевдонимов: строится один раз за O(n), каждый выбор — O(1)"""
+
+    def __init__(self, items, weights):
+        if not items:
+            raise ValueError("Пустой список для выбора")
+        count = len(items)
+        total = float(sum(weights))
+        scaled = [weight * count / total for weight in weights]
+        self.items = list(items)
+        self.probability = [0.0] * count
+        self.alias = [0] * count
+
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        for i in small + large:
+            self.probability[i] = 1.0
+
+    def sample(self, rng=random):
+        i = rng.randrange(len(self.items))
+        return self.items[i] if rng.random() < self.probability[i] else self.items[self.alias[i]]
+
+    def sample_many(self, k, rng=random):
+        return [self.sample(rng) for _ in range(k)]
+
+
+def compile_case_samplers(cases, skins, rarity_probabilities):
+    """Собирает по сэмплеру на каждый кейс. Несуществующие скины пропускаются,
+    кейсы без доступных скинов в результат не попадают"""
+    samplers = {}
+    for case_id, case_data in cases.items():
+        case_skins = [skin for skin in case_data["contains"] if skin in skins]
+        if case_skins:
+            weights = [rarity_probabilities[skins[skin]["rarity"]] for skin in case_skins]
+            samplers[case_id] = AliasSampler(case_skins, weights)
+    return samplers
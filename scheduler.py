@@ -0,0 +1,112 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+
+
+# --- Отложенное удаление сообщений ---
+class DeleteScheduler:
+    """Одна фоновая задача вместо asyncio.sleep в каждом обработчике.
+
+    Задания "удалить сообщение X в чате Y в момент T" лежат в куче по времени.
+    Наступившие удаления одного чата отправляются одним delete_messages.
+    Очередь периодически сохраняется в файл, чтобы после перезапуска
+    ничего не осталось висеть в чатах.
+    """
+
+    MAX_BATCH = 100  # лимит delete_messages
+
+    def __init__(self, bot, path, persist_interval=5.0):
+        self.bot = bot
+        self.path = path
+        self.persist_interval = persist_interval
+        self._heap = []
+        self._dirty = False
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def schedule(self, chat_id, message_id, delay):
+        due = time.time() + delay
+        heapq.heappush(self._heap, (due, int(chat_id), int(message_id)))
+        self._dirty = True
+        if self._heap[0][0] == due:
+            self._wakeup.set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    # --- Сохранение очереди ---
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._heap = [tuple(job) for job in json.load(f)]
+                heapq.heapify(self._heap)
+        except Exception as e:
+            logging.error(f"Ошибка загрузки отложенных удалений: {e}")
+
+    def _save(self):
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._heap, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except Exception as e:
+            logging.error(f"Ошибка сохранения отложенных удалений: {e}")
+
+    # --- Выполнение ---
+    def _pop_due(self):
+        now = time.time()
+        by_chat = {}
+        while self._heap and self._heap[0][0] <= now:
+            _, chat_id, message_id = heapq.heappop(self._heap)
+            by_chat.setdefault(chat_id, []).append(message_id)
+        if by_chat:
+            self._dirty = True
+        return by_chat
+
+    async def _delete(self, chat_id, message_ids):
+        for start in range(0, len(message_ids), self.MAX_BATCH):
+            batch = message_ids[start:start + self.MAX_BATCH]
+            try:
+                if len(batch) == 1:
+                    await self.bot.delete_message(chat_id=chat_id, message_id=batch[0])
+                else:
+                    await self.bot.delete_messages(chat_id=chat_id, message_ids=batch)
+            except Exception as e:
+                logging.warning(f"Не удалось удалить сообщения {batch} в чате {chat_id}: {e}")
+
+    async def _run(self):
+        while True:
+            by_chat = self._pop_due()
+            if by_chat:
+                await asyncio.gather(*(self._delete(chat_id, ids) for chat_id, ids in by_chat.items()))
+            if self._dirty:
+                self._save()
+
+            self._wakeup.clear()
+            timeout = self.persist_interval
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._load()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._save()
@@ -0,0 +1,22 @@
+"""Процесс пересчёта сезона для seasons.SeasonRunner.
+
+Отдельная точка входа, чтобы дочерний процесс не импортировал bot.py (и с ним
+хранилище, журналы и сессию бота). Читает из stdin строки JSON [чаты, правила],
+на каждую пишет в stdout строку JSON с результатом seasons.transform_chunk.
+"""
+
+import json
+import sys
+
+from seasons import transform_chunk
+
+
+def main():
+    for line in sys.stdin:
+        chats, rules = json.loads(line)
+        sys.stdout.write(json.dumps(transform_chunk(chats, rules), ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""Смена сезона: сброс или затухание очков и награды лучшим игрокам каждого чата.
+
+Сортировка и пересчёт чатов выполняются пачками в процессах season_worker.py, в цикле событий
+остаётся только запись результата под блокировками игроков. Ход смены сезона
+сохраняется в контрольную точку, итоги каждого чата - в архив сезона.
+
+Без бота, по файлам данных (бот при этом должен быть остановлен):
+    python seasons.py --backend json --path csgo_data.json --season 2024-1 --mode decay --decay 0.5 --rewards 1:500,2:300,3:100
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "season_worker.py")
+# Ответ воркера - одна строка JSON на всю пачку
+WORKER_LINE_LIMIT = 1 << 30
+
+# Правила сезона - обычный словарь, чтобы без труда уходить в процессы пула:
+#   mode     - reset (обнулить), decay (умножить на decay) или none (только награды)
+#   decay    - множитель для decay, округление вниз
+#   rewards  - {место: очки} - награда лучшим игрокам чата, начисляется после сброса
+#   archive_top - сколько мест каждого чата сохранять в архив
+DEFAULT_RULES = {"mode": "decay", "decay": 0.5, "rewards": {}, "archive_top": 10}
+
+
+def parse_rewards(value):
+    """"1:500,2:300" -> {1: 500, 2: 300}"""
+    rewards = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        place, _, points = item.partition(":")
+        rewards[int(place)] = int(points)
+    return rewards
+
+
+# --- Преобразование (выполняется в процессах season_worker.py) ---
+def season_player(player, rules, reward=0):
+    """Новое состояние игрока после конца сезона"""
+    player = dict(player)
+    if rules["mode"] == "reset":
+        player["wins"] = 0
+        player["points"] = 0
+    elif rules["mode"] == "decay":
+        player["wins"] = math.floor(player.get("wins", 0) * rules["decay"])
+        player["points"] = math.floor(player.get("points", 0) * rules["decay"])
+    player["points"] = player.get("points", 0) + reward
+    return player
+
+
+def transform_chunk(chats, rules):
+    """[(chat_id, {user_id: игрок})] -> [(chat_id, {user_id: [было, стало]}, итоговая таблица)]"""
+    rewards = {int(place): points for place, points in rules.get("rewards", {}).items()}
+    results = []
+    for chat_id, players in chats:
+        ranking = sorted(
+            players.items(),
+            key=lambda item: (item[1].get("wins", 0), item[1].get("points", 0)),
+            reverse=True
+        )
+        standings = [
+            [place, user_id, player.get("wins", 0), player.get("points", 0)]
+            for place, (user_id, player) in enumerate(ranking[:rules.get("archive_top", 10)], 1)
+        ]
+        changes = {}
+        for place, (user_id, player) in enumerate(ranking, 1):
+            new = season_player(player, rules, rewards.get(place, 0))
+            if new != player:
+                changes[user_id] = [player, new]
+        results.append((chat_id, changes, standings))
+    return results
+
+
+class TransformWorker:
+    """Дочерний процесс season_worker.py, пачки и результаты ходят строками JSON"""
+
+    def __init__(self):
+        self.process = None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_PATH,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=WORKER_LINE_LIMIT
+        )
+
+    async def transform(self, chats, rules):
+        self.process.stdin.write((json.dumps([chats, rules], ensure_ascii=False) + "\n").encode("utf-8"))
+        await self.process.stdin.drain()
+        line = await self.process.stdout.readline()
+        if not line:
+            raise RuntimeError(f"Процесс пересчёта сезона завершился с кодом {await self.process.wait()}")
+        return json.loads(line)
+
+    async def close(self):
+        # Состояния у воркера нет, поэтому и посреди пачки его можно просто остановить
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+
+# --- Смена сезона ---
+class SeasonRunner:
+    """Применяет правила сезона ко всем чатам, не блокируя цикл событий.
+
+    Чаты идут пачками по chunk_size: пачка читается из хранилища в потоке,
+    делится между workers процессами season_worker.py (при workers=0 считается
+    в потоке этого процесса), а результат записывается
+    обратно под блокировками игроков. Игрок, которого успели изменить живые
+    обработчики, пересчитывается от текущего состояния, а не затирается.
+
+    Прогресс лежит в checkpoint_path: перед записью пачки туда сохраняются
+    старые и новые значения, после - чат отмечается готовым. Прерванная смена
+    сезона при следующем запуске продолжается с того же места. Итоговая таблица
+    чата пишется в archive_dir/season-{id}.jsonl сразу после его игроков, и в
+    недописанной пачке пропускаются чаты, которые уже есть в архиве.
+
+    owns(chat_id) отбирает чаты этого процесса, если хранилище общее
+    для нескольких шардов (SQLite в sharding.py).
+    """
+
+    def __init__(self, store, locks, checkpoint_path="season_checkpoint.json", archive_dir="seasons",
+                 chunk_size=200, workers=2, owns=None):
+        self.store = store
+        self.locks = locks
+        self.checkpoint_path = checkpoint_path
+        self.archive_dir = archive_dir
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.owns = owns
+        self.state = self._load()
+        self._task = None
+
+    # --- Контрольная точка ---
+    def _load(self):
+        try:
+            if os.path.exists(self.checkpoint_path):
+                with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.error(f"Ошибка загрузки контрольной точки сезона: {e}")
+        return {"last_completed": None, "last_scheduled": None, "current": None}
+
+    def _save(self):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def _chat_ids(self):
+        chat_ids = self.store.chat_ids()
+        if self.owns is None:
+            return chat_ids
+        return [chat_id for chat_id in chat_ids if self.owns(chat_id)]
+
+    def progress(self):
+        """(id сезона, готово чатов, всего чатов) текущей смены сезона или None"""
+        current = self.state.get("current")
+        if current is None:
+            return None
+        return current["season"], len(current["done"]), current["total"]
+
+    # --- Запуск ---
+    def start(self, season_id, rules, scheduled=None):
+        """Запускает смену сезона в фоне. False, если она уже идёт или этот сезон уже закрыт.
+        scheduled - номер периода, если смену запустило расписание"""
+        if self.running or self.state.get("last_completed") == season_id:
+            return False
+        self._task = asyncio.create_task(self.run(season_id, rules, scheduled))
+        return True
+
+    async def run(self, season_id, rules, scheduled=None):
+        current = self.state.get("current")
+        if current is not None and current["season"] != season_id:
+            logging.warning(f"Незавершённая смена сезона {current['season']} доводится до конца перед {season_id}")
+            await self.run(current["season"], current["rules"], current.get("scheduled"))
+        current = self.state.get("current")
+        if current is None:
+            chat_ids = await asyncio.to_thread(self._chat_ids)
+            current = self.state["current"] = {
+                "season": season_id, "rules": rules, "scheduled": scheduled, "started": int(time.time()),
+                "total": len(chat_ids), "done": [], "in_flight": None
+            }
+            self._save()
+        else:
+            chat_ids = await asyncio.to_thread(self._chat_ids)
+            logging.info(f"Продолжается смена сезона {season_id}: готово {len(current['done'])} из {current['total']}")
+        rules = current["rules"]
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archive_path = os.path.join(self.archive_dir, f"season-{season_id}.jsonl")
+
+        # Пачка, записанная не до конца перед остановкой
+        if current["in_flight"] is not None:
+            await self._apply(current["in_flight"], rules, archive_path, resumed=True)
+
+        done = set(current["done"])
+        pending = [chat_id for chat_id in sorted(chat_ids) if chat_id not in done]
+        workers = [TransformWorker() for _ in range(min(self.workers, len(pending)))]
+        try:
+            for worker in workers:
+                await worker.start()
+            for start in range(0, len(pending), self.chunk_size):
+                chunk_ids = pending[start:start + self.chunk_size]
+                chats = await asyncio.to_thread(
+                    lambda: [(chat_id, self.store.scan_players(chat_id)) for chat_id in chunk_ids]
+                )
+                results = await self._transform(workers, chats, rules)
+                current["in_flight"] = results
+                self._save()
+                await self._apply(results, rules, archive_path, resumed=False)
+        finally:
+            for worker in workers:
+                await worker.close()
+
+        # Ручные смены сезона не сдвигают расписание
+        if current.get("scheduled") is not None:
+            self.state["last_scheduled"] = current["scheduled"]
+        self.state["last_completed"] = season_id
+        self.state["current"] = None
+        self._save()
+        logging.info(f"Сезон {season_id} закрыт, итоги в {archive_path}")
+
+    async def _transform(self, workers, chats, rules):
+        if not workers:
+            return await asyncio.to_thread(transform_chunk, chats, rules)
+        parts = [chats[index::len(workers)] for index in range(len(workers))]
+        results = await asyncio.gather(*(
+            worker.transform(part, rules) for worker, part in zip(workers, parts) if part
+        ))
+        return [result for part in results for result in part]
+
+    @staticmethod
+    def _archived_chats(archive_path):
+        """Чаты, уже записанные в архив. Оборванную последнюю строку закрывает переводом строки"""
+        if not os.path.exists(archive_path):
+            return set()
+        chats = set()
+        line = ""
+        with open(archive_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    chats.add(json.loads(line)["chat"])
+                except ValueError:
+                    continue
+        if line and not line.endswith("\n"):
+            with open(archive_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+        return chats
+
+    async def _apply(self, results, rules, archive_path, resumed):
+        current = self.state["current"]
+        # Строка архива пишется сразу после чата, поэтому после сбоя по архиву видно,
+        # какие чаты пачки уже записаны целиком
+        archived = self._archived_chats(archive_path) if resumed else set()
+        with open(archive_path, "a", encoding="utf-8") as archive:
+            for chat_id, changes, standings in results:
+                if chat_id in archived:
+                    continue
+                for user_id, (old, new) in changes.items():
+                    async with self.locks.hold("player", chat_id, user_id):
+                        player = self.store.get_player(chat_id, user_id)
+                        if player is None or player == new:
+                            continue
+                        if player == old:
+                            self.store.put_player(chat_id, user_id, new, reason="season")
+                        else:
+                            # Игрок успел сыграть, пока пачка считалась или пока бот перезапускался
+                            reward = new["points"] - season_player(old, rules)["points"]
+                            self.store.put_player(chat_id, user_id, season_player(player, rules, reward), reason="season")
+                archive.write(json.dumps({"chat": chat_id, "standings": standings}, ensure_ascii=False) + "\n")
+                archive.flush()
+                await asyncio.sleep(0)
+            os.fsync(archive.fileno())
+        current["done"].extend(chat_id for chat_id, _, _ in results)
+        current["in_flight"] = None
+        self._save()
+
+
+# --- Расписание ---
+class SeasonScheduler:
+    """Раз в season_days дней закрывает прошедший сезон. Номер сезона - число целых
+    периодов с начала эпохи, поэтому после перезапуска ничего не запускается повторно.
+    Последний закрытый по расписанию номер хранится отдельно (last_scheduled),
+    ручные смены сезона через /season на него не влияют"""
+
+    def __init__(self, runner, rules, season_days, check_interval=600):
+        self.runner = runner
+        self.rules = rules
+        self.period = season_days * 86400
+        self.check_interval = check_interval
+        self._task = None
+
+    def current_season(self):
+        return int(time.time() // self.period)
+
+    def start(self):
+        if self.period and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._task, self.runner._task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = None
+
+    async def _run(self):
+        # Первый запуск только запоминает текущий сезон, закрывать нечего
+        if self.runner.state.get("last_scheduled") is None:
+            self.runner.state["last_scheduled"] = self.current_season() - 1
+            self.runner._save()
+        while True:
+            current = self.runner.state.get("current")
+            if current is not None and not self.runner.running:
+                self.runner.start(current["season"], current["rules"], current.get("scheduled"))
+            else:
+                finished = self.current_season() - 1
+                if finished > self.runner.state["last_scheduled"]:
+                    self.runner.start(finished, self.rules, scheduled=finished)
+            await asyncio.sleep(self.check_interval)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from locks import KeyedLocks
+    from storage import ChatDirStore, CompactStore, JournalStore, JsonStore, SnapshotStore, SQLiteStore
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Смена сезона по файлам данных")
+    parser.add_argument("--backend", default="json", choices=["json", "compact", "snapshot", "chatdir", "journal", "sqlite"])
+    parser.add_argument("--path", default="csgo_data.json")
+    parser.add_argument("--season", required=True)
+    parser.add_argument("--mode", default="decay", choices=["reset", "decay", "none"])
+    parser.add_argument("--decay", type=float, default=0.5)
+    parser.add_argument("--rewards", default="")
+    parser.add_argument("--archive-top", type=int, default=10)
+    parser.add_argument("--checkpoint", default="season_checkpoint.json")
+    parser.add_argument("--archive-dir", default="seasons")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    store = {
+        "json": JsonStore, "compact": CompactStore, "snapshot": SnapshotStore, "chatdir": ChatDirStore,
+        "journal": JournalStore, "sqlite": SQLiteStore
+    }[args.backend](args.path)
+    runner = SeasonRunner(
+        store, KeyedLocks(), args.checkpoint, args.archive_dir, chunk_size=args.chunk_size, workers=args.workers
+    )
+    rules = {"mode": args.mode, "decay": args.decay, "rewards": parse_rewards(args.rewards), "archive_top": args.archive_top}
+    started = time.perf_counter()
+    try:
+        if runner.state.get("last_completed") == args.season:
+            print(f"Сезон {args.season} уже закрыт")
+        else:
+            asyncio.run(runner.run(args.season, rules))
+            print(f"Сезон {args.season} закрыт за {time.perf_counter() - started:.1f} с")
+    finally:
+        # Записать свои изменения, но не сжимать журнал и не останавливать чужой сброс
+        store.flush()
+        store.release()
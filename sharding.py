@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import sys
+import threading
+from multiprocessing.managers import BaseManager
+
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Число шардов, с которым разложены чаты, рядом с каталогами шардов
+LAYOUT_FILE = "shards.json"
+
+
+# --- Координатор промокодов ---
+class PromoManager(BaseManager):
+    pass
+
+
+class PromoClient(BaseManager):
+    pass
+
+
+def serve_promo_coordinator(ledger, address, authkey):
+    """Отдаёт журнал промокодов воркерам. Лимиты активаций общие на все шарды"""
+    PromoManager.register("ledger", callable=lambda: ledger)
+    manager = PromoManager(address=address, authkey=authkey)
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, name="promo-coordinator", daemon=True).start()
+    return server
+
+
+def connect_promo_coordinator(address, authkey):
+    host, port = address.rsplit(":", 1)
+    PromoClient.register("ledger")
+    manager = PromoClient(address=(host, int(port)), authkey=bytes.fromhex(authkey))
+    manager.connect()
+    return manager.ledger()
+
+
+# --- Маршрутизация ---
+def chat_id_of(update):
+    """Чат апдейта (по сырому JSON) или None"""
+    for key in ("message", "edited_message", "channel_post", "my_chat_member", "chat_member", "chat_join_request"):
+        if update.get(key):
+            return update[key]["chat"]["id"]
+    callback_query = update.get("callback_query")
+    if callback_query:
+        if callback_query.get("message"):
+            return callback_query["message"]["chat"]["id"]
+        return callback_query["from"]["id"]
+    return None
+
+
+def shard_of(chat_id, workers):
+    return 0 if chat_id is None else int(chat_id) % workers
+
+
+def check_shard_layout(base_dir, workers):
+    """Проверяет, что чаты в base_dir разложены на столько же шардов, и запоминает число.
+    Возвращает сохранённое число шардов, если оно другое, иначе None"""
+    path = os.path.join(base_dir, LAYOUT_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            stored = json.load(f)["workers"]
+    else:
+        # Каталоги шардов, разложенные до появления shards.json
+        existing = [name for name in os.listdir(base_dir) if name.startswith("shard-")] if os.path.isdir(base_dir) else []
+        stored = len(existing) or None
+    if stored is not None and stored != workers:
+        return stored
+    os.makedirs(base_dir, exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"workers": workers}, f)
+    os.replace(f"{path}.tmp", path)
+    return None
+
+
+def split_into_shards(store, workers, base_dir, data_file):
+    """Раскладывает чаты из общего хранилища по файлам шардов (только если их ещё нет)"""
+    paths = [os.path.join(base_dir, f"shard-{index}", data_file) for index in range(workers)]
+    if any(os.path.exists(path) for path in paths):
+        return
+    shards = [{} for _ in range(workers)]
+    for chat_id in store.chat_ids():
+        shards[shard_of(chat_id, workers)][chat_id] = {"players": store.scan_players(chat_id)}
+    for path, data in zip(paths, shards):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    logging.info(f"Чаты разложены по {workers} шардам в {base_dir}")
+
+
+# --- Воркер ---
+def worker_main(index, workers, queue, coordinator, authkey, shard_dir, env):
+    """Точка входа процесса-воркера: свой каталог состояния, свой цикл событий"""
+    os.environ.update(env)
+    os.environ["SHARD_INDEX"] = str(index)
+    os.environ["SHARD_COUNT"] = str(workers)
+    os.environ["PROMO_COORDINATOR"] = coordinator
+    os.environ["PROMO_COORDINATOR_KEY"] = authkey
+    os.makedirs(shard_dir, exist_ok=True)
+    os.chdir(shard_dir)
+    sys.path.insert(0, CODE_DIR)
+
+    import bot
+    try:
+        asyncio.run(bot.main(worker_queue=queue))
+    except KeyboardInterrupt:
+        pass
+
+
+async def run_worker(bot, dp, queue, max_in_flight=100):
+    """Берёт апдейты из очереди фронта и обрабатывает их в этом процессе"""
+    from aiogram.types import Update
+
+    loop = asyncio.get_running_loop()
+    updates = asyncio.Queue()
+
+    # Отдельный поток-демон, чтобы блокирующий queue.get не мешал завершению процесса
+    def pump():
+        while True:
+            raw = queue.get()
+            loop.call_soon_threadsafe(updates.put_nowait, raw)
+            if raw is None:
+                return
+    threading.Thread(target=pump, name="shard-queue", daemon=True).start()
+
+    slots = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+
+    async def process(update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logging.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            slots.release()
+
+    while True:
+        raw = await updates.get()
+        if raw is None:
+            break
+        update = Update.model_validate(json.loads(raw), context={"bot": bot})
+        await slots.acquire()
+        task = asyncio.create_task(process(update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# --- Фронт ---
+class ShardRouter:
+    def __init__(self, queues):
+        self.queues = queues
+
+    def route(self, update):
+        self.queues[shard_of(chat_id_of(update), len(self.queues))].put(json.dumps(update, ensure_ascii=False))
+
+
+async def poll_updates(token, router):
+    from aiogram import Bot
+
+    bot = Bot(token=token)
+    offset = None
+    # Как и skip_updates=True в обычном режиме: старые апдейты пропускаются
+    await bot.delete_webhook(drop_pending_updates=True)
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30)
+            except Exception as e:
+                logging.error(f"Ошибка получения апдейтов: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                router.route(update.model_dump(mode="json", exclude_none=True))
+                offset = update.update_id + 1
+    finally:
+        await bot.session.close()
+
+
+async def serve_webhook(router, host, port, path, secret_token=None, token=None, public_url=None):
+    async def handle(request):
+        if secret_token and request.headers.get(SECRET_HEADER) != secret_token:
+            return web.Response(status=401)
+        try:
+            router.route(await request.json())
+        except Exception as e:
+            logging.warning(f"Некорректный апдейт на вебхуке: {e}")
+            return web.Response(status=400)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Фронт слушает вебхук http://{host}:{port}{path}")
+    if public_url:
+        from aiogram import Bot
+
+        bot = Bot(token=token)
+        await bot.set_webhook(url=public_url.rstrip("/") + path, secret_token=secret_token, drop_pending_updates=True)
+        await bot.session.close()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from promo import PromoLedger
+    from storage import ChatDirStore, JournalStore, JsonStore, SnapshotStore, SQLiteStore, migrate_json_to_sqlite
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах с разбиением чатов по шардам")
+    # Без значения по умолчанию: число шардов не должно зависеть от машины
+    parser.add_argument("--workers", type=int, required=True)
+    parser.add_argument("--shards-dir", default="shards")
+    parser.add_argument("--coordinator-port", type=int, default=0)
+    args = parser.parse_args()
+
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        logging.error("Токен бота не найден в .env файле")
+        sys.exit(1)
+
+    backend = os.getenv("STORAGE_BACKEND", "json")
+    data_file = os.getenv("DATA_FILE", "csgo_data.json")
+    base_dir = os.path.abspath(args.shards_dir)
+    stored_workers = check_shard_layout(base_dir, args.workers)
+    if stored_workers is not None:
+        logging.error(
+            f"Чаты в {base_dir} разложены на {stored_workers} шардов, а запущено {args.workers}: "
+            f"запустите с --workers {stored_workers} или разложите чаты заново в другой каталог (--shards-dir)"
+        )
+        sys.exit(1)
+    env = {
+        # Общий лимит Telegram делится между воркерами
+        "OUTBOX_GLOBAL_RATE": str(float(os.getenv("OUTBOX_GLOBAL_RATE", "25")) / args.workers),
+        "DATA_FILE": os.path.basename(data_file),
+        # Снимок шарда строится из его JSON-файла при первом запуске воркера
+        "SNAPSHOT_FILE": os.path.basename(os.getenv("SNAPSHOT_FILE", "csgo_data.snap")),
+        "CHAT_DIR": os.path.basename(os.getenv("CHAT_DIR", "chats")),
+    }
+    db_file = os.path.abspath(os.getenv("DB_FILE", "csgo_data.db"))
+    if backend == "sqlite":
+        # SQLite в режиме WAL можно открыть из нескольких процессов: каждый пишет только свои чаты.
+        # Воркеры запускаются в каталогах шардов, где исходного JSON нет, поэтому переносит фронт
+        env["DB_FILE"] = db_file
+        if not os.path.exists(db_file) and os.path.exists(data_file):
+            migrate_json_to_sqlite(data_file, db_file)
+    else:
+        if backend == "journal":
+            source = JournalStore(data_file)
+        elif backend == "chatdir" and os.path.exists(os.getenv("CHAT_DIR", "chats")):
+            source = ChatDirStore(os.getenv("CHAT_DIR", "chats"))
+        elif backend == "snapshot":
+            source = SnapshotStore(os.getenv("SNAPSHOT_FILE", "csgo_data.snap"), json_path=data_file)
+        else:
+            source = JsonStore(data_file)
+        split_into_shards(source, args.workers, base_dir, os.path.basename(data_file))
+        source.release()
+
+    # Промокоды живут во фронте и общие для всех шардов
+    promo_log_file = os.getenv("PROMO_LOG_FILE", "promo_redemptions.jsonl")
+    ledger = PromoLedger(os.getenv("PROMO_FILE", "promo_codes.json"), promo_log_file)
+    legacy_uses = None
+    if not os.path.exists(promo_log_file):
+        legacy_store = SQLiteStore(db_file) if backend == "sqlite" else JsonStore(data_file)
+        legacy_uses = legacy_store.get_promo_uses()
+        legacy_store.release()
+    ledger.load(legacy_uses=legacy_uses)
+    authkey = secrets.token_bytes(16)
+    coordinator = serve_promo_coordinator(ledger, ("127.0.0.1", args.coordinator_port), authkey)
+    coordinator_address = f"{coordinator.address[0]}:{coordinator.address[1]}"
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(args.workers)]
+    processes = [
+        context.Process(
+            target=worker_main,
+            args=(index, args.workers, queue, coordinator_address, authkey.hex(),
+                  os.path.join(base_dir, f"shard-{index}"), env),
+            name=f"shard-{index}"
+        )
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    router = ShardRouter(queues)
+    try:
+        if os.getenv("BOT_MODE", "polling") == "webhook":
+            asyncio.run(serve_webhook(
+                router,
+                os.getenv("WEBHOOK_HOST", "127.0.0.1"),
+                int(os.getenv("WEBHOOK_PORT", "8080")),
+                os.getenv("WEBHOOK_PATH", "/webhook"),
+                os.getenv("WEBHOOK_SECRET"),
+                token=token,
+                public_url=os.getenv("WEBHOOK_URL")
+            ))
+        else:
+            asyncio.run(poll_updates(token, router))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=30)
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
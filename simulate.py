@@ -0,0 +1,446 @@
+"""Монте-Карло экономики бота: шансы матчей, окупаемость кейсов, инфляция очков.
+
+Таблицы (WIN_CHANCE, DRAW_CHANCE, WIN_POINTS, LOSE_POINTS, RARITY_PROBABILITIES,
+CASES, SKINS, RANKS, промокоды) берутся прямо из bot.py, поведение игроков задаётся
+параметрами. Все игроки считаются разом массивами numpy, цикл идёт только по дням
+и слотам кулдауна: миллион игроков за 90 дней - около 15 секунд на одном ядре.
+
+    python simulate.py --players 1000000 --days 90
+    python simulate.py --players 200000 --days 60 --sensitivity --json report.json
+
+Нужен numpy (pip install numpy), самому боту он не нужен.
+"""
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_TOKEN = "123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi"
+
+# Поведение игроков:
+#   activity    - средняя доля доступных матчей, которые игрок играет (у каждого своя, бета-распределение)
+#   case_rate   - вероятность в день открыть кейс, если хватает очков (кейс - случайный из доступных)
+#   promo_rate  - доля игроков, которые за срок активируют каждый промокод
+#   population  - сколько игроков у бота на самом деле: лимиты промокодов масштабируются на выборку
+BEHAVIOUR = {"activity": 0.5, "case_rate": 0.2, "promo_rate": 0.05, "population": 10000}
+ACTIVITY_CONCENTRATION = 4.0
+
+# Шаг анализа чувствительности: параметр сдвигается на ±10%
+SENSITIVITY_STEP = 0.1
+
+# Матчи считаются блоками игроков, чтобы рабочие массивы блока оставались в кэше процессора
+# (на миллионе игроков целиком слот втрое медленнее)
+MATCH_BLOCK = 16384
+
+# Файлы и службы бота на время импорта уводятся во временный каталог: bot.py читает .env,
+# а load_dotenv не перекрывает уже заданные переменные. Пустая строка - выключено
+ISOLATED_FILES = (
+    "DATA_FILE", "DB_FILE", "SNAPSHOT_FILE", "CHAT_DIR", "PROMO_LOG_FILE", "COOLDOWN_NOTIFY_FILE",
+    "SCHEDULED_DELETES_FILE", "MEDIA_CACHE_FILE", "SEASON_CHECKPOINT_FILE", "SEASON_ARCHIVE_DIR",
+    "EXPORT_DIR", "PROFILE_DIR"
+)
+ISOLATED_SETTINGS = {"STORAGE_BACKEND": "json", "PROMO_COORDINATOR": "", "METRICS_PORT": "0", "MEDIA_WARMUP_CHAT": ""}
+
+
+# --- Параметры ---
+def economy_from_bot():
+    """Таблицы экономики из bot.py. Бот импортируется во временном каталоге с пустыми данными"""
+    work_dir = tempfile.mkdtemp(prefix="simulate-")
+    cwd = os.getcwd()
+    isolated = dict(ISOLATED_SETTINGS, **{name: os.path.join(work_dir, name.lower()) for name in ISOLATED_FILES})
+    saved_env = {name: os.environ.get(name) for name in isolated}
+    try:
+        os.chdir(work_dir)
+        os.environ.update(isolated)
+        os.environ.setdefault("BOT_TOKEN", FAKE_TOKEN)
+        os.environ.setdefault("PROMO_FILE", os.path.join(CODE_DIR, "promo_codes.json"))
+        sys.path.insert(0, CODE_DIR)
+        import bot
+
+        params = {
+            "win_chance": bot.WIN_CHANCE,
+            "draw_chance": bot.DRAW_CHANCE,
+            "win_points": list(bot.WIN_POINTS),
+            "lose_points": list(bot.LOSE_POINTS),
+            "cooldown_hours": bot.COOLDOWN_HOURS,
+            "rarity": dict(bot.RARITY_PROBABILITIES),
+            "skins": {name: {"rarity": skin["rarity"], "price": skin["price"]} for name, skin in bot.SKINS.items()},
+            "cases": {
+                case_id: {"price": case["price"], "contains": [skin for skin in case["contains"] if skin in bot.SKINS]}
+                for case_id, case in bot.CASES.items()
+            },
+            "promos": {
+                code: {"points": info.get("points", 0), "max_uses": info.get("max_uses", 0)}
+                for code, info in bot.promo_ledger.codes.items()
+            },
+            "ranks": {int(wins): rank for wins, rank in bot.RANKS.items()}
+        }
+        bot.promo_ledger.close()
+        bot.store.close()
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    params.update(BEHAVIOUR)
+    return params
+
+
+def case_tables(params):
+    """{case_id: (цена, накопленные вероятности скинов, цены скинов)}"""
+    tables = {}
+    for case_id, case in params["cases"].items():
+        if not case["contains"]:
+            continue
+        weights = np.array([params["rarity"][params["skins"][skin]["rarity"]] for skin in case["contains"]], dtype=float)
+        prices = np.array([params["skins"][skin]["price"] for skin in case["contains"]], dtype=np.int32)
+        tables[case_id] = (case["price"], np.cumsum(weights / weights.sum()), prices)
+    return tables
+
+
+def case_ev(params):
+    """Точное матожидание выигрыша от открытия кейса: средняя цена скина минус цена кейса"""
+    result = {}
+    for case_id, (price, cdf, prices) in case_tables(params).items():
+        probabilities = np.diff(cdf, prepend=0.0)
+        result[case_id] = float(probabilities @ prices - price)
+    return result
+
+
+# --- Моделирование ---
+def play_slot(rng, points, wins, cuts, scales, win_points, lose_points):
+    """Один слот кулдауна для всех игроков. Возвращает (очков выиграно, очков проиграно).
+
+    Один случайный r на игрока решает всё: r < win_cut - победа, r < lose_cut - поражение,
+    иначе ничья или игрок не играл. Внутри своего отрезка r равномерно, из него же берутся очки
+    """
+    win_cut, lose_cut = cuts
+    win_scale, lose_scale = scales
+    block = min(MATCH_BLOCK, len(points))
+    roll, scaled = np.empty(block, dtype=np.float32), np.empty(block, dtype=np.float32)
+    won, lost = np.empty(block, dtype=bool), np.empty(block, dtype=bool)
+    gain, loss = np.empty(block, dtype=np.int32), np.empty(block, dtype=np.int32)
+    gained = lost_points = 0
+    for start in range(0, len(points), block):
+        end = min(len(points), start + block)
+        size = end - start
+        r, s, w, l, g, x = roll[:size], scaled[:size], won[:size], lost[:size], gain[:size], loss[:size]
+        player_points = points[start:end]
+        rng.random(size, dtype=np.float32, out=r)
+        np.less(r, win_cut[start:end], out=w)
+        np.less(r, lose_cut[start:end], out=l)
+        l ^= w
+
+        np.multiply(r, win_scale[start:end], out=s)
+        g[...] = s
+        np.minimum(g, win_points[1] - win_points[0], out=g)
+        g += win_points[0]
+        g *= w
+
+        np.subtract(r, win_cut[start:end], out=s)
+        s *= lose_scale[start:end]
+        x[...] = s
+        np.clip(x, 0, lose_points[1] - lose_points[0], out=x)
+        x += lose_points[0]
+        x *= l
+        np.minimum(x, player_points, out=x)
+
+        wins[start:end] += w
+        player_points += g
+        player_points -= x
+        gained += int(g.sum())
+        lost_points += int(x.sum())
+    return gained, lost_points
+
+
+def simulate(params, players, days, seed=1):
+    rng = np.random.default_rng(seed)
+    n = players
+    slots = max(1, int(24 // params["cooldown_hours"])) if params["cooldown_hours"] > 0 else 24
+    lose_chance = 100 - params["win_chance"] - params["draw_chance"]
+    total_chance = params["win_chance"] + params["draw_chance"] + lose_chance
+    win_p = params["win_chance"] / total_chance
+    lose_p = lose_chance / total_chance
+    win_low, win_high = params["win_points"]
+    lose_low, lose_high = params["lose_points"]
+
+    mean_activity = min(max(params["activity"], 1e-6), 1 - 1e-6)
+    activity = rng.beta(
+        mean_activity * ACTIVITY_CONCENTRATION, (1 - mean_activity) * ACTIVITY_CONCENTRATION, n
+    ).astype(np.float32)
+    # Отрезки исходов и масштаб очков для play_slot
+    win_cut = activity * np.float32(win_p)
+    lose_cut = activity * np.float32(win_p + lose_p)
+    cuts = (win_cut, lose_cut)
+    scales = (
+        np.float32(win_high - win_low + 1) / np.maximum(win_cut, np.float32(1e-9)),
+        np.float32(lose_high - lose_low + 1) / np.maximum(lose_cut - win_cut, np.float32(1e-9))
+    )
+    points = np.zeros(n, dtype=np.int32)
+    wins = np.zeros(n, dtype=np.int32)
+
+    # Ранг по числу побед - через таблицу, searchsorted по миллиону игроков на порядок медленнее
+    thresholds = np.array(sorted(params["ranks"]), dtype=np.int32)
+    tier_of_wins = (np.searchsorted(thresholds, np.arange(thresholds[-1] + 1), side="right") - 1).astype(np.int16)
+    tier = tier_of_wins[np.minimum(wins, thresholds[-1])]
+    first_day = np.full((len(thresholds), n), -1, dtype=np.int16)
+    first_day[:tier.max() + 1] = 0
+
+    cases = case_tables(params)
+    case_ids = sorted(cases, key=lambda case_id: cases[case_id][0])
+    case_prices = np.array([cases[case_id][0] for case_id in case_ids], dtype=np.int32)
+    opened = dict.fromkeys(case_ids, 0)
+    spent = dict.fromkeys(case_ids, 0)
+    paid = dict.fromkeys(case_ids, 0)
+    profitable = dict.fromkeys(case_ids, 0)
+
+    # Промокоды: желающие активируют в случайный день, лимит достаётся самым ранним
+    promo_players, promo_days, promo_points = [], [], []
+    for info in params["promos"].values():
+        cap = int(round(info["max_uses"] * n / params["population"]))
+        want = np.flatnonzero(rng.random(n) < params["promo_rate"])
+        want_days = rng.integers(0, days, len(want))
+        order = np.argsort(want_days, kind="stable")[:cap]
+        promo_players.append(want[order])
+        promo_days.append(want_days[order])
+        promo_points.append(np.full(len(order), info["points"], dtype=np.int32))
+    promo_players = np.concatenate(promo_players) if promo_players else np.zeros(0, dtype=np.int64)
+    promo_days = np.concatenate(promo_days) if promo_days else np.zeros(0, dtype=np.int64)
+    promo_points = np.concatenate(promo_points) if promo_points else np.zeros(0, dtype=np.int32)
+    order = np.argsort(promo_days, kind="stable")
+    promo_players, promo_days, promo_points = promo_players[order], promo_days[order], promo_points[order]
+    promo_bounds = np.searchsorted(promo_days, np.arange(days + 1))
+
+    match_in = match_out = promo_in = 0
+    mean_points = [0.0]
+    for day in range(days):
+        for _ in range(slots):
+            gained, lost = play_slot(rng, points, wins, cuts, scales, (win_low, win_high), (lose_low, lose_high))
+            match_in += gained
+            match_out += lost
+
+        # Кейсы: раз в день, случайный из тех, на которые хватает очков. Кейсы отсортированы
+        # по цене, поэтому доступны первые affordable из них
+        buyers = np.flatnonzero(rng.random(n, dtype=np.float32) < params["case_rate"])
+        if len(buyers) and case_ids:
+            balance = points[buyers]
+            affordable = np.zeros(len(buyers), dtype=np.int32)
+            for price in case_prices:
+                affordable += balance >= price
+            choice = np.minimum((rng.random(len(buyers), dtype=np.float32) * affordable).astype(np.int32), affordable - 1)
+            for index, case_id in enumerate(case_ids):
+                selected = buyers[choice == index]
+                if not len(selected):
+                    continue
+                price, cdf, skin_prices = cases[case_id]
+                payout = skin_prices[np.minimum(np.searchsorted(cdf, rng.random(len(selected)), side="right"), len(cdf) - 1)]
+                points[selected] += payout - price
+                opened[case_id] += len(selected)
+                spent[case_id] += price * len(selected)
+                paid[case_id] += int(payout.sum())
+                profitable[case_id] += int((payout > price).sum())
+
+        start, end = promo_bounds[day], promo_bounds[day + 1]
+        if end > start:
+            np.add.at(points, promo_players[start:end], promo_points[start:end])
+            promo_in += int(promo_points[start:end].sum())
+
+        # Ранги: для игроков, поднявшихся за день, отмечается день каждого пройденного порога
+        new_tier = tier_of_wins[np.minimum(wins, thresholds[-1])]
+        moved = np.flatnonzero(new_tier != tier)
+        if len(moved):
+            old = tier[moved]
+            steps = new_tier[moved] - old
+            for step in range(1, int(steps.max()) + 1):
+                climbed = steps >= step
+                first_day[old[climbed] + step, moved[climbed]] = day + 1
+        tier = new_tier
+        mean_points.append(float(points.mean()))
+
+    ranks = []
+    for level, threshold in enumerate(thresholds):
+        reached = first_day[level][first_day[level] >= 0]
+        ranks.append({
+            "wins": int(threshold),
+            "rank": params["ranks"][int(threshold)],
+            "reached": round(len(reached) / n, 4),
+            "mean_days": float(reached.mean()) if len(reached) else None,
+            "median_days": float(np.median(reached)) if len(reached) else None,
+            "p90_days": float(np.percentile(reached, 90)) if len(reached) else None
+        })
+    ev = case_ev(params)
+    per_player_day = n * days
+    return {
+        "players": n,
+        "days": days,
+        "matches_per_day": slots,
+        "mean_points": mean_points,
+        "points_end": {
+            "mean": float(points.mean()),
+            "median": float(np.median(points)),
+            "p90": float(np.percentile(points, 90)),
+            "max": int(points.max())
+        },
+        "inflation_per_day": {
+            "total": mean_points[-1] / days,
+            "matches": (match_in - match_out) / per_player_day,
+            "cases": sum(paid[case_id] - spent[case_id] for case_id in case_ids) / per_player_day,
+            "promos": promo_in / per_player_day
+        },
+        "cases": {
+            case_id: {
+                "price": int(cases[case_id][0]),
+                "ev": round(ev[case_id], 2),
+                "ev_simulated": round((paid[case_id] - spent[case_id]) / opened[case_id], 2) if opened[case_id] else None,
+                "profitable_share": round(profitable[case_id] / opened[case_id], 4) if opened[case_id] else None,
+                "opened": opened[case_id]
+            }
+            for case_id in case_ids
+        },
+        "ranks": ranks
+    }
+
+
+# --- Чувствительность ---
+def parameter_names(params):
+    names = ["win_chance", "draw_chance", "win_points", "lose_points", "skin_prices", "promo_points",
+             "activity", "case_rate"]
+    names += [f"rarity:{rarity}" for rarity in params["rarity"]]
+    names += [f"case_price:{case_id}" for case_id in params["cases"]]
+    return names
+
+
+def perturb(params, name, factor):
+    """Копия параметров, где name умножен на factor. Возвращает (копия, было, стало)"""
+    params = copy.deepcopy(params)
+    if name in ("win_chance", "draw_chance"):
+        before = params[name]
+        params[name] = min(round(before * factor), 100 - params["draw_chance" if name == "win_chance" else "win_chance"])
+        after = params[name]
+    elif name in ("win_points", "lose_points"):
+        before = params[name][1]
+        params[name][1] = max(params[name][0], round(before * factor))
+        after = params[name][1]
+    elif name in ("activity", "case_rate"):
+        before = params[name]
+        after = params[name] = min(1.0, before * factor)
+    elif name == "skin_prices":
+        before, after = 1.0, factor
+        for skin in params["skins"].values():
+            skin["price"] = round(skin["price"] * factor)
+    elif name == "promo_points":
+        before, after = 1.0, factor
+        for promo in params["promos"].values():
+            promo["points"] = round(promo["points"] * factor)
+    elif name.startswith("rarity:"):
+        rarity = name.split(":", 1)[1]
+        before = params["rarity"][rarity]
+        after = params["rarity"][rarity] = before * factor
+    elif name.startswith("case_price:"):
+        case = params["cases"][name.split(":", 1)[1]]
+        before = case["price"]
+        after = case["price"] = round(before * factor)
+    else:
+        raise ValueError(f"Неизвестный параметр: {name}")
+    return params, before, after
+
+
+def headline_metrics(result):
+    """Плоский словарь метрик, по которым считается чувствительность. Дни до ранга берутся
+    средние, а не медиана: медиана в целых днях слишком грубая для разности ±10%"""
+    metrics = {"inflation_per_day": result["inflation_per_day"]["total"]}
+    for case_id, case in result["cases"].items():
+        metrics[f"ev:{case_id}"] = case["ev"]
+    for rank in result["ranks"]:
+        if rank["wins"] and rank["reached"] >= 0.5:
+            metrics[f"days_to:{rank['rank']}"] = rank["mean_days"]
+    return metrics
+
+
+def sensitivity(params, players, days, seed=1, step=SENSITIVITY_STEP):
+    """Эластичность каждой метрики по каждому параметру: на сколько % меняется метрика
+    при изменении параметра на 1% (центральная разность ±step, общий seed)"""
+    base = headline_metrics(simulate(params, players, days, seed))
+    table = {}
+    for name in parameter_names(params):
+        low_params, before, low = perturb(params, name, 1 - step)
+        high_params, _, high = perturb(params, name, 1 + step)
+        if high == low or not before:
+            continue
+        low_metrics = headline_metrics(simulate(low_params, players, days, seed))
+        high_metrics = headline_metrics(simulate(high_params, players, days, seed))
+        row = {}
+        for metric, value in base.items():
+            if not value or low_metrics.get(metric) is None or high_metrics.get(metric) is None:
+                continue
+            row[metric] = round(((high_metrics[metric] - low_metrics[metric]) / abs(value)) / ((high - low) / before), 3)
+        table[name] = row
+    return base, table
+
+
+# --- Отчёт ---
+def print_report(result, elapsed):
+    print(f"Игроков: {result['players']}, дней: {result['days']}, матчей в день максимум: {result['matches_per_day']} "
+          f"({elapsed:.1f} с)")
+    print("\nКейсы (матожидание выигрыша за открытие):")
+    for case_id, case in result["cases"].items():
+        print(f"  {case_id:14} цена {case['price']:4}  EV {case['ev']:+8.2f}  по модели {case['ev_simulated']}  "
+              f"в плюс {case['profitable_share']}  открыто {case['opened']}")
+    points = result["points_end"]
+    print(f"\nОчки в конце: среднее {points['mean']:.1f}, медиана {points['median']:.0f}, "
+          f"90% {points['p90']:.0f}, максимум {points['max']}")
+    inflation = result["inflation_per_day"]
+    print(f"Инфляция очков на игрока в день: {inflation['total']:.2f} "
+          f"(матчи {inflation['matches']:+.2f}, кейсы {inflation['cases']:+.2f}, промокоды {inflation['promos']:+.2f})")
+    print("\nРанги (побед, доля дошедших, медиана и 90% дней):")
+    for rank in result["ranks"]:
+        days = f"{rank['median_days']:6.1f} / {rank['p90_days']:6.1f}" if rank["median_days"] is not None else "     -"
+        print(f"  {rank['wins']:5} {rank['rank']:18} {rank['reached'] * 100:6.1f}%  {days}")
+
+
+def print_sensitivity(table, threshold=0.05):
+    """Эластичности меньше threshold по модулю не печатаются: это шум расхождения случайных потоков"""
+    print("\nЧувствительность (эластичность: % изменения метрики на 1% параметра):")
+    for name, row in table.items():
+        cells = ", ".join(f"{metric} {value:+.2f}" for metric, value in row.items() if abs(value) >= threshold)
+        print(f"  {name:24} {cells or '-'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Монте-Карло экономики бота")
+    parser.add_argument("--players", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=1)
+    for name, value in BEHAVIOUR.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    parser.add_argument("--sensitivity", action="store_true", help="посчитать эластичность метрик по параметрам")
+    parser.add_argument("--sensitivity-players", type=int, default=100000)
+    parser.add_argument("--json", help="записать отчёт в файл")
+    args = parser.parse_args()
+
+    params = economy_from_bot()
+    params.update({name: getattr(args, name) for name in BEHAVIOUR})
+    started = time.perf_counter()
+    result = simulate(params, args.players, args.days, args.seed)
+    print_report(result, time.perf_counter() - started)
+    report = {"params": params, "result": result}
+    if args.sensitivity:
+        started = time.perf_counter()
+        _, table = sensitivity(params, args.sensitivity_players, args.days, args.seed)
+        print_sensitivity(table)
+        print(f"({time.perf_counter() - started:.1f} с)")
+        report["sensitivity"] = table
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
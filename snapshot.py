@@ -0,0 +1,159 @@
+"""Бинарный снимок игроков с каталогом чатов.
+
+Файл целиком отображается в память (mmap), а блок чата декодируется только
+при первом обращении к этому чату, поэтому открытие снимка не зависит от
+числа неактивных чатов. Все числа little-endian.
+
+    заголовок   4s  магия b"CSNP"
+                H   версия формата (1)
+                H   флаги (0)
+                I   число чатов
+                Q   смещение каталога
+                Q   смещение метаданных
+                I   длина метаданных
+    метаданные  JSON в UTF-8: всё, что не относится к игрокам (например, старый "promo_uses")
+    блоки       по блоку на чат в формате model.ChatColumns
+    каталог     на каждый чат: q chat_id, Q смещение блока, I длина блока;
+                отсортирован по chat_id, поиск - двоичный прямо по mmap
+
+Конвертация для отладки:
+    python snapshot.py to-json csgo_data.snap csgo_data.json
+    python snapshot.py from-json csgo_data.json csgo_data.snap
+    python snapshot.py info csgo_data.snap
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+from model import ChatColumns
+
+HEADER = struct.Struct("<4sHHIQQI")
+ENTRY = struct.Struct("<qQI")
+MAGIC = b"CSNP"
+VERSION = 1
+
+
+def encode_snapshot(blocks, meta=None):
+    """blocks - [(chat_id, байты блока ChatColumns)], meta - словарь для метаданных"""
+    blocks = sorted((int(chat_id), block) for chat_id, block in blocks)
+    meta_bytes = json.dumps(meta or {}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    position = HEADER.size + len(meta_bytes)
+    directory = []
+    for chat_id, block in blocks:
+        directory.append(ENTRY.pack(chat_id, position, len(block)))
+        position += len(block)
+    header = HEADER.pack(MAGIC, VERSION, 0, len(blocks), position, HEADER.size, len(meta_bytes))
+    return b"".join([header, meta_bytes] + [block for _, block in blocks] + directory)
+
+
+class SnapshotReader:
+    """Читает снимок через mmap. Блоки отдаются копией байтов, поэтому reader можно закрыть в любой момент"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.count, self._directory, meta_offset, meta_length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path}: неизвестный формат снимка {magic!r} v{version}")
+        self._meta = (meta_offset, meta_length)
+
+    def _entry(self, index):
+        return ENTRY.unpack_from(self._mmap, self._directory + index * ENTRY.size)
+
+    def meta(self):
+        offset, length = self._meta
+        return json.loads(self._mmap[offset:offset + length].decode("utf-8"))
+
+    def find(self, chat_id):
+        """Байты блока чата или None"""
+        chat_id = int(chat_id)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_chat, offset, length = self._entry(middle)
+            if entry_chat == chat_id:
+                return self._mmap[offset:offset + length]
+            if entry_chat < chat_id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def chat_ids(self):
+        return [str(self._entry(index)[0]) for index in range(self.count)]
+
+    def blocks(self):
+        for index in range(self.count):
+            chat_id, offset, length = self._entry(index)
+            yield str(chat_id), self._mmap[offset:offset + length]
+
+    def close(self):
+        self._mmap.close()
+
+
+# --- Конвертация ---
+def json_to_snapshot(json_path, snapshot_path):
+    from storage import normalize_players
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = normalize_players(json.load(f))
+    meta = {key: data.pop(key) for key in ("promo_uses",) if key in data}
+    blocks = [
+        (chat_id, ChatColumns.from_players(chat.get("players", {})).to_bytes())
+        for chat_id, chat in data.items()
+    ]
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_snapshot(blocks, meta))
+    os.replace(tmp_path, snapshot_path)
+    logging.info(f"Снимок записан: {snapshot_path} ({len(blocks)} чатов)")
+    return len(blocks)
+
+
+def snapshot_to_json(snapshot_path, json_path):
+    reader = SnapshotReader(snapshot_path)
+    try:
+        data = {
+            chat_id: {"players": ChatColumns.from_bytes(block).to_players()}
+            for chat_id, block in reader.blocks()
+        }
+        data.update(reader.meta())
+    finally:
+        reader.close()
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return len(data)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Бинарные снимки игроков")
+    commands = parser.add_subparsers(dest="command", required=True)
+    to_json = commands.add_parser("to-json", help="снимок -> JSON")
+    to_json.add_argument("snapshot_path")
+    to_json.add_argument("json_path")
+    from_json = commands.add_parser("from-json", help="JSON -> снимок")
+    from_json.add_argument("json_path")
+    from_json.add_argument("snapshot_path")
+    info = commands.add_parser("info", help="сводка по снимку")
+    info.add_argument("snapshot_path")
+    args = parser.parse_args()
+
+    if args.command == "to-json":
+        snapshot_to_json(args.snapshot_path, args.json_path)
+    elif args.command == "from-json":
+        json_to_snapshot(args.json_path, args.snapshot_path)
+    else:
+        started = time.perf_counter()
+        reader = SnapshotReader(args.snapshot_path)
+        opened = time.perf_counter() - started
+        print(f"{args.snapshot_path}: {reader.count} чатов, {os.path.getsize(args.snapshot_path)} байт, открыт за {opened * 1000:.2f} мс")
+        print(f"Метаданные: {', '.join(reader.meta()) or 'нет'}")
+        reader.close()
@@ -0,0 +1,802 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from metrics import Counter
+from model import ChatColumns
+from snapshot import SnapshotReader, encode_snapshot
+
+BYTES_WRITTEN = Counter("bot_storage_bytes_written_total", "Байт записано хранилищем на диск", ["kind"])
+
+
+def last_play_epoch(value):
+    """last_play в секундах эпохи. Старые записи хранили ISO-строку"""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    if value.isdigit():
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        logging.warning(f"Некорректное время последней игры: {value!r}")
+        return None
+
+
+def normalize_players(data):
+    """Переводит last_play всех игроков в секунды эпохи"""
+    for chat_id, chat in data.items():
+        if chat_id == "promo_uses":
+            continue
+        for player in chat.get("players", {}).values():
+            if "last_play" in player:
+                player["last_play"] = last_play_epoch(player["last_play"])
+    return data
+
+
+# --- Интерфейс хранилища ---
+class BaseStore:
+    """Общий интерфейс хранилищ. Идентификаторы чатов и игроков передаются строками"""
+
+    def __init__(self):
+        self._listeners = []
+        self._evict_listeners = []
+
+    def add_listener(self, listener):
+        """listener(chat_id, user_id, player) вызывается после каждого put_player"""
+        self._listeners.append(listener)
+
+    def add_evict_listener(self, listener):
+        """listener(chat_id) вызывается, когда чат вытесняется из кэша хранилища,
+        чтобы производные кэши (таблицы лидеров) не переживали сам чат"""
+        self._evict_listeners.append(listener)
+
+    def _notify_evicted(self, chat_id):
+        for listener in self._evict_listeners:
+            try:
+                listener(chat_id)
+            except Exception as e:
+                logging.error(f"Ошибка обработчика вытеснения чата: {e}")
+
+    def _notify(self, chat_id, user_id, player):
+        for listener in self._listeners:
+            try:
+                listener(chat_id, user_id, player)
+            except Exception as e:
+                logging.error(f"Ошибка обработчика изменений хранилища: {e}")
+
+    def get_player(self, chat_id, user_id):
+        raise NotImplementedError
+
+    def get_players(self, chat_id):
+        raise NotImplementedError
+
+    def scan_players(self, chat_id):
+        """Как get_players, но для обхода всех чатов подряд: чат не оседает в кэше хранилища"""
+        return self.get_players(chat_id)
+
+    def chat_ids(self):
+        """Чаты, в которых есть игроки"""
+        raise NotImplementedError
+
+    def put_player(self, chat_id, user_id, player, reason=None):
+        """reason - причина изменения: match, case_buy, skin_payout, case_open, promo, settings"""
+        raise NotImplementedError
+
+    def get_promo_uses(self):
+        """Старые активации промокодов {код: {"used": n, "used_by": [user_id, ...]}}.
+        Нужны только для переноса в журнал промокодов (promo.PromoLedger)"""
+        raise NotImplementedError
+
+    def start(self):
+        pass
+
+    def flush(self):
+        return False
+
+    def close(self):
+        pass
+
+    def release(self):
+        """Закрывает хранилище, ничего не записывая: для инструментов, которые только
+        читают, в том числе при работающем боте (close сбрасывает и сжимает данные)"""
+        pass
+
+
+# --- JSON-файл целиком в памяти ---
+class JsonStore(BaseStore):
+    """Держит данные игроков в памяти и сбрасывает их в JSON-файл из фонового потока"""
+
+    def __init__(self, path, flush_interval=5.0, flush_threshold=200):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._lock = threading.RLock()
+        self._data = normalize_players(self._load())
+        self._dirty = set()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            return {}
+        except Exception as e:
+            logging.error(f"Ошибка загрузки данных: {e}")
+            return {}
+
+    # --- Игроки ---
+    def get_player(self, chat_id, user_id):
+        with self._lock:
+            player = self._data.get(chat_id, {}).get("players", {}).get(user_id)
+            return dict(player) if player is not None else None
+
+    def get_players(self, chat_id):
+        with self._lock:
+            players = self._data.get(chat_id, {}).get("players", {})
+            return {user_id: dict(player) for user_id, player in players.items()}
+
+    def chat_ids(self):
+        with self._lock:
+            return [key for key, value in self._data.items() if isinstance(value, dict) and "players" in value]
+
+    def put_player(self, chat_id, user_id, player, reason=None):
+        with self._lock:
+            chat = self._data.setdefault(chat_id, {"players": {}})
+            chat.setdefault("players", {})[user_id] = dict(player)
+            self._mark_dirty(chat_id)
+        self._notify(chat_id, user_id, player)
+
+    # --- Старые активации промокодов (ключ "promo_uses") ---
+    def get_promo_uses(self):
+        with self._lock:
+            promo_uses = self._data.get("promo_uses", {})
+            return {
+                code: {"used": info.get("used", 0), "used_by": list(info.get("used_by", []))}
+                for code, info in promo_uses.items()
+            }
+
+    # --- Сброс на диск ---
+    def _snapshot(self):
+        """Содержимое файла данных в байтах. Вызывается под блокировкой"""
+        return json.dumps(self._data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def _snapshot_written(self):
+        """Вызывается после того, как новый файл данных встал на место"""
+        pass
+
+    def _mark_dirty(self, key):
+        self._dirty.add(key)
+        if len(self._dirty) >= self.flush_threshold:
+            self._wakeup.set()
+
+    def flush(self):
+        """Записывает снимок, если с прошлого сброса что-то изменилось"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            snapshot = self._snapshot()
+            dirty = self._dirty
+            self._dirty = set()
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                written = f.write(snapshot)
+                # Без fsync после сбоя питания переименованный файл может оказаться пустым
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._snapshot_written()
+            BYTES_WRITTEN.inc(written, kind="snapshot")
+        except Exception as e:
+            logging.error(f"Ошибка сохранения данных: {e}")
+            with self._lock:
+                self._dirty |= dirty
+            return False
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="store-flusher", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+# --- Компактное представление в памяти ---
+class CompactStore(JsonStore):
+    """Как JsonStore (тот же файл на диске), но в памяти игроки лежат столбцами model.ChatColumns:
+    id и числа в array вместо словаря на каждого игрока"""
+
+    def __init__(self, path, flush_interval=5.0, flush_threshold=200):
+        super().__init__(path, flush_interval=flush_interval, flush_threshold=flush_threshold)
+        self._chats = {}
+        for chat_id in list(self._data):
+            if chat_id != "promo_uses":
+                self._chats[chat_id] = ChatColumns.from_players(self._data.pop(chat_id).get("players", {}))
+
+    def _columns(self, chat_id):
+        return self._chats.get(chat_id)
+
+    def get_player(self, chat_id, user_id):
+        with self._lock:
+            columns = self._columns(chat_id)
+            return columns.get(user_id) if columns is not None else None
+
+    def get_players(self, chat_id):
+        with self._lock:
+            columns = self._columns(chat_id)
+            return columns.to_players() if columns is not None else {}
+
+    def chat_ids(self):
+        with self._lock:
+            return list(self._chats)
+
+    def put_player(self, chat_id, user_id, player, reason=None):
+        with self._lock:
+            columns = self._columns(chat_id)
+            if columns is None:
+                columns = self._chats[chat_id] = ChatColumns()
+            columns.put(user_id, player)
+            self._mark_dirty(chat_id)
+        self._notify(chat_id, user_id, player)
+
+    def _snapshot(self):
+        data = {chat_id: {"players": columns.to_players()} for chat_id, columns in self._chats.items()}
+        data.update(self._data)
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# --- Бинарный снимок с ленивой загрузкой чатов ---
+class SnapshotStore(CompactStore):
+    """Данные в бинарном снимке (snapshot.py), отображённом в память. Чат декодируется
+    в ChatColumns при первом обращении, остальные так и лежат в mmap.
+
+    Если снимка ещё нет, данные один раз берутся из json_path и снимок пишется при первом сбросе.
+    """
+
+    def __init__(self, path, json_path=None, flush_interval=5.0, flush_threshold=200):
+        self.json_path = json_path
+        self._reader = None
+        super().__init__(path, flush_interval=flush_interval, flush_threshold=flush_threshold)
+        if self._reader is None and self._chats:
+            self._mark_dirty(None)
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                self._reader = SnapshotReader(self.path)
+                return self._reader.meta()
+            except Exception as e:
+                logging.error(f"Ошибка загрузки снимка: {e}")
+                return {}
+        if self.json_path and os.path.exists(self.json_path):
+            logging.info(f"Снимка {self.path} нет, данные переносятся из {self.json_path}")
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _columns(self, chat_id):
+        columns = self._chats.get(chat_id)
+        if columns is None and self._reader is not None:
+            block = self._reader.find(chat_id)
+            if block is not None:
+                columns = self._chats[chat_id] = ChatColumns.from_bytes(block)
+        return columns
+
+    def scan_players(self, chat_id):
+        with self._lock:
+            columns = self._chats.get(chat_id)
+            if columns is not None:
+                return columns.to_players()
+            block = self._reader.find(chat_id) if self._reader is not None else None
+        return ChatColumns.from_bytes(block).to_players() if block is not None else {}
+
+    def chat_ids(self):
+        with self._lock:
+            chat_ids = set(self._chats)
+            if self._reader is not None:
+                chat_ids.update(self._reader.chat_ids())
+            return list(chat_ids)
+
+    def _snapshot(self):
+        # Нетронутые чаты копируются из старого снимка как есть, без декодирования
+        blocks = {chat_id: columns.to_bytes() for chat_id, columns in self._chats.items()}
+        if self._reader is not None:
+            for chat_id, block in self._reader.blocks():
+                blocks.setdefault(chat_id, block)
+        return encode_snapshot(blocks.items(), self._data)
+
+    def _snapshot_written(self):
+        with self._lock:
+            reader, self._reader = self._reader, SnapshotReader(self.path)
+        if reader is not None:
+            reader.close()
+
+    def close(self):
+        super().close()
+        if self._reader is not None:
+            self._reader.close()
+
+    def release(self):
+        if self._reader is not None:
+            self._reader.close()
+
+
+# --- Файл на каждый чат, в памяти только недавние чаты ---
+class ChatDirStore(JsonStore):
+    """Каталог с файлом {chat_id}.chat (формат model.ChatColumns) на каждый чат.
+
+    Чат читается с диска при первом обращении и держится в LRU на cache_size чатов.
+    Изменённые чаты пишутся фоновым потоком, а вытесняемый изменённый чат - сразу
+    при вытеснении. Запись идёт под блокировкой, по одному чату, чтобы старое
+    состояние чата не могло лечь на диск поверх нового.
+    Данные не об игроках (старый "promo_uses") лежат в meta.json.
+    """
+
+    META_FILE = "meta.json"
+    SUFFIX = ".chat"
+
+    def __init__(self, path, cache_size=1000, flush_interval=5.0, flush_threshold=200):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        os.makedirs(path, exist_ok=True)
+        super().__init__(path, flush_interval=flush_interval, flush_threshold=flush_threshold)
+
+    def _load(self):
+        try:
+            meta_path = os.path.join(self.path, self.META_FILE)
+            if os.path.exists(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.error(f"Ошибка загрузки {self.META_FILE}: {e}")
+        return {}
+
+    def _chat_path(self, chat_id):
+        return os.path.join(self.path, f"{chat_id}{self.SUFFIX}")
+
+    def _columns(self, chat_id):
+        """ChatColumns чата из кэша или с диска. Вызывается под блокировкой"""
+        columns = self._cache.get(chat_id)
+        if columns is not None:
+            self._cache.move_to_end(chat_id)
+            return columns
+        chat_path = self._chat_path(chat_id)
+        if not os.path.exists(chat_path):
+            return None
+        with open(chat_path, "rb") as f:
+            columns = ChatColumns.from_bytes(f.read())
+        self._cache_chat(chat_id, columns)
+        return columns
+
+    def _cache_chat(self, chat_id, columns):
+        self._cache[chat_id] = columns
+        while len(self._cache) > self.cache_size:
+            evicted_id, evicted = self._cache.popitem(last=False)
+            if evicted_id in self._dirty:
+                self._write_chat(evicted_id, evicted)
+                self._dirty.discard(evicted_id)
+            self._notify_evicted(evicted_id)
+
+    def _write_chat(self, chat_id, columns):
+        block = columns.to_bytes()
+        tmp_path = f"{self._chat_path(chat_id)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._chat_path(chat_id))
+        BYTES_WRITTEN.inc(len(block), kind="chat")
+
+    # --- Игроки ---
+    def get_player(self, chat_id, user_id):
+        with self._lock:
+            columns = self._columns(chat_id)
+            return columns.get(user_id) if columns is not None else None
+
+    def get_players(self, chat_id):
+        with self._lock:
+            columns = self._columns(chat_id)
+            return columns.to_players() if columns is not None else {}
+
+    def scan_players(self, chat_id):
+        with self._lock:
+            columns = self._cache.get(chat_id)
+            if columns is not None:
+                return columns.to_players()
+            chat_path = self._chat_path(chat_id)
+            if not os.path.exists(chat_path):
+                return {}
+            with open(chat_path, "rb") as f:
+                block = f.read()
+        return ChatColumns.from_bytes(block).to_players()
+
+    def chat_ids(self):
+        with self._lock:
+            chat_ids = set(self._cache)
+        chat_ids.update(
+            name[:-len(self.SUFFIX)] for name in os.listdir(self.path) if name.endswith(self.SUFFIX)
+        )
+        return list(chat_ids)
+
+    def put_player(self, chat_id, user_id, player, reason=None):
+        with self._lock:
+            columns = self._columns(chat_id)
+            if columns is None:
+                columns = ChatColumns()
+                self._cache_chat(chat_id, columns)
+            columns.put(user_id, player)
+            self._mark_dirty(chat_id)
+        self._notify(chat_id, user_id, player)
+
+    # --- Сброс на диск ---
+    def flush(self):
+        with self._lock:
+            dirty = list(self._dirty)
+        written = False
+        for chat_id in dirty:
+            with self._lock:
+                columns = self._cache.get(chat_id)
+                if chat_id not in self._dirty or columns is None:
+                    continue
+                try:
+                    self._write_chat(chat_id, columns)
+                except Exception as e:
+                    logging.error(f"Ошибка сохранения чата {chat_id}: {e}")
+                    continue
+                self._dirty.discard(chat_id)
+                written = True
+        return written
+
+
+# --- Журнал изменений + периодические снимки ---
+class JournalStore(JsonStore):
+    """Пишет каждое изменение маленькой записью в журнал и время от времени сворачивает его в снимок
+
+    Записи копятся в памяти и сбрасываются пачкой (group commit): fsync выполняется
+    раз в fsync_interval секунд или как только накопилось fsync_records записей.
+    Когда в журнале набирается compact_records записей, состояние пишется в новый
+    снимок через временный файл и rename, а журнал начинается заново.
+    При старте загружается снимок и поверх него проигрывается хвост журнала.
+    """
+
+    def __init__(self, path, fsync_interval=0.05, fsync_records=100, compact_records=50000):
+        self.journal_path = f"{path}.journal"
+        self.fsync_records = fsync_records
+        self.compact_records = compact_records
+        self._pending = []
+        self._journal_records = 0
+        super().__init__(path, flush_interval=fsync_interval)
+        self._journal = open(self.journal_path, "ab")
+
+    def _load(self):
+        data = super()._load()
+        replayed = 0
+        # .old остаётся, если процесс упал посреди сжатия; записи идемпотентны
+        for journal_path in (f"{self.journal_path}.old", self.journal_path):
+            if not os.path.exists(journal_path):
+                continue
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logging.warning(f"Пропущена повреждённая запись журнала в {journal_path}")
+                        continue
+                    self._apply(data, record)
+                    replayed += 1
+        self._journal_records = replayed
+        if replayed:
+            logging.info(f"Проиграно записей журнала: {replayed}")
+        return data
+
+    @staticmethod
+    def _apply(data, record):
+        if record["op"] == "player":
+            chat = data.setdefault(record["chat"], {"players": {}})
+            chat.setdefault("players", {})[record["user"]] = record["player"]
+        elif record["op"] == "promo":
+            # Записи старого формата, активации теперь ведёт promo.PromoLedger
+            info = data.setdefault("promo_uses", {}).setdefault(record["code"], {"used": 0, "used_by": []})
+            info["used"] = record["used"]
+            used_by = info.setdefault("used_by", [])
+            if record["user"] not in used_by:
+                used_by.append(record["user"])
+
+    def _append(self, record):
+        self._pending.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        if len(self._pending) >= self.fsync_records:
+            self._wakeup.set()
+
+    def _mark_dirty(self, key):
+        # Грязные чаты не отслеживаются: всё нужное уже лежит в журнале
+        pass
+
+    def put_player(self, chat_id, user_id, player, reason=None):
+        with self._lock:
+            super().put_player(chat_id, user_id, player)
+            self._append({"op": "player", "reason": reason, "chat": chat_id, "user": user_id, "player": player})
+
+    def _write_pending(self):
+        """Дописывает накопленные записи в журнал одним write + fsync. Вызывается под блокировкой"""
+        if not self._pending:
+            return False
+        chunk = ("\n".join(self._pending) + "\n").encode("utf-8")
+        self._journal.write(chunk)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_records += len(self._pending)
+        self._pending = []
+        BYTES_WRITTEN.inc(len(chunk), kind="journal")
+        return True
+
+    def flush(self):
+        try:
+            with self._lock:
+                written = self._write_pending()
+        except Exception as e:
+            logging.error(f"Ошибка записи журнала: {e}")
+            return False
+        if self._journal_records >= self.compact_records:
+            self.compact()
+        return written
+
+    def compact(self):
+        """Сворачивает журнал в новый снимок"""
+        old_path = f"{self.journal_path}.old"
+        try:
+            with self._lock:
+                self._write_pending()
+                snapshot = self._snapshot()
+                self._journal.close()
+                try:
+                    if os.path.exists(old_path):
+                        # Прошлое сжатие не записало снимок, и .old всё ещё нужен: дописываем к нему
+                        with open(self.journal_path, "rb") as src, open(old_path, "ab") as dst:
+                            shutil.copyfileobj(src, dst)
+                            dst.flush()
+                            os.fsync(dst.fileno())
+                        os.remove(self.journal_path)
+                    else:
+                        os.replace(self.journal_path, old_path)
+                finally:
+                    self._journal = open(self.journal_path, "ab")
+                self._journal_records = 0
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                written = f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            os.remove(old_path)
+            BYTES_WRITTEN.inc(written, kind="snapshot")
+        except Exception as e:
+            logging.error(f"Ошибка сжатия журнала: {e}")
+
+    def close(self):
+        super().close()
+        self.compact()
+        with self._lock:
+            self._journal.close()
+
+    def release(self):
+        with self._lock:
+            self._journal.close()
+
+
+# --- SQLite ---
+class SQLiteStore(BaseStore):
+    """Хранит по строке на каждого игрока чата; все запросы точечные и идут по индексам"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            wins INTEGER NOT NULL DEFAULT 0,
+            points INTEGER NOT NULL DEFAULT 0,
+            last_play INTEGER,
+            username TEXT,
+            notify INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID;
+        -- Топ строится в leaderboard.ChatLeaderboards, индекс только замедлял запись
+        DROP INDEX IF EXISTS players_top;
+        CREATE TABLE IF NOT EXISTS promo_counters (
+            code TEXT PRIMARY KEY,
+            used INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS promo_uses (
+            code TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (code, user_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        # Базы, созданные до появления уведомлений
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(players)")}
+        if "notify" not in columns:
+            self._conn.execute("ALTER TABLE players ADD COLUMN notify INTEGER NOT NULL DEFAULT 0")
+
+    COLUMNS = "wins, points, last_play, username, notify"
+
+    @staticmethod
+    def _row_to_player(row):
+        wins, points, last_play, username, notify = row
+        player = {"wins": wins, "points": points}
+        if last_play is not None:
+            player["last_play"] = last_play_epoch(last_play)
+        if username is not None:
+            player["username"] = username
+        if notify:
+            player["notify"] = True
+        return player
+
+    # --- Игроки ---
+    def get_player(self, chat_id, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self.COLUMNS} FROM players WHERE chat_id = ? AND user_id = ?",
+                (int(chat_id), int(user_id))
+            ).fetchone()
+        return self._row_to_player(row) if row else None
+
+    def get_players(self, chat_id):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT user_id, {self.COLUMNS} FROM players WHERE chat_id = ?",
+                (int(chat_id),)
+            ).fetchall()
+        return {str(row[0]): self._row_to_player(row[1:]) for row in rows}
+
+    def chat_ids(self):
+        with self._lock:
+            return [str(row[0]) for row in self._conn.execute("SELECT DISTINCT chat_id FROM players")]
+
+    def put_player(self, chat_id, user_id, player, reason=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO players (chat_id, user_id, wins, points, last_play, username, notify) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (int(chat_id), int(user_id), player.get("wins", 0), player.get("points", 0),
+                 last_play_epoch(player.get("last_play")), player.get("username"), int(bool(player.get("notify"))))
+            )
+        self._notify(chat_id, user_id, player)
+
+    # --- Старые активации промокодов ---
+    def get_promo_uses(self):
+        with self._lock:
+            promo_uses = {
+                code: {"used": used, "used_by": []}
+                for code, used in self._conn.execute("SELECT code, used FROM promo_counters")
+            }
+            for code, user_id in self._conn.execute("SELECT code, user_id FROM promo_uses"):
+                promo_uses.setdefault(code, {"used": 0, "used_by": []})["used_by"].append(str(user_id))
+        return promo_uses
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def release(self):
+        self.close()
+
+
+# --- Миграция ---
+def split_json_to_chat_dir(json_path, dir_path):
+    """Раскладывает csgo_data.json по файлам чатов для ChatDirStore.
+
+    Каталог собирается в dir_path.tmp и переименовывается целиком, когда все
+    чаты записаны: бот раскладывает файл, если dir_path нет, и оборванная
+    раскладка не должна выглядеть готовой. dir_path не должен существовать.
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = normalize_players(json.load(f))
+
+    tmp_path = f"{dir_path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    meta = {key: data.pop(key) for key in ("promo_uses",) if key in data}
+    with open(os.path.join(tmp_path, ChatDirStore.META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    for chat_id, chat in data.items():
+        with open(os.path.join(tmp_path, f"{chat_id}{ChatDirStore.SUFFIX}"), "wb") as f:
+            f.write(ChatColumns.from_players(chat.get("players", {})).to_bytes())
+    os.rename(tmp_path, dir_path)
+    logging.info(f"Разложено чатов: {len(data)} ({json_path} -> {dir_path})")
+    return len(data)
+
+
+def migrate_json_to_sqlite(json_path, db_path):
+    """Переносит csgo_data.json в базу SQLite одной транзакцией.
+
+    База собирается в db_path.tmp и переименовывается только после COMMIT:
+    бот запускает перенос, если db_path нет, и недописанная база не должна
+    выглядеть готовой.
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    tmp_path = f"{db_path}.tmp"
+    for path in (tmp_path, f"{tmp_path}-wal", f"{tmp_path}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    db = SQLiteStore(tmp_path)
+    players = 0
+    with db._lock:
+        db._conn.execute("BEGIN")
+        try:
+            for chat_id, chat in data.items():
+                if chat_id == "promo_uses":
+                    for code, info in chat.items():
+                        db._conn.execute(
+                            "INSERT OR REPLACE INTO promo_counters (code, used) VALUES (?, ?)",
+                            (code, info.get("used", 0))
+                        )
+                        db._conn.executemany(
+                            "INSERT OR IGNORE INTO promo_uses (code, user_id) VALUES (?, ?)",
+                            [(code, int(user_id)) for user_id in info.get("used_by", [])]
+                        )
+                    continue
+                for user_id, player in chat.get("players", {}).items():
+                    db.put_player(chat_id, user_id, player)
+                    players += 1
+            db._conn.execute("COMMIT")
+        except Exception:
+            db._conn.execute("ROLLBACK")
+            db.close()
+            raise
+    db.close()
+    os.replace(tmp_path, db_path)
+    logging.info(f"Перенесено игроков: {players} ({json_path} -> {db_path})")
+    return players
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Инструменты хранилища CS:GO Match Bot")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="перенести JSON-файл в SQLite")
+    migrate.add_argument("json_path", nargs="?", default="csgo_data.json")
+    migrate.add_argument("db_path", nargs="?", default="csgo_data.db")
+    split = commands.add_parser("split", help="разложить JSON-файл по файлам чатов")
+    split.add_argument("json_path", nargs="?", default="csgo_data.json")
+    split.add_argument("dir_path", nargs="?", default="chats")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_json_to_sqlite(args.json_path, args.db_path)
+    elif args.command == "split":
+        split_json_to_chat_dir(args.json_path, args.dir_path)
@@ -0,0 +1,96 @@
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+
+from metrics import Counter
+from outbox import TokenBucket
+
+DROPPED = Counter("bot_throttle_dropped_total", "Отброшенных нажатий и команд", ["action", "reason"])
+
+
+def parse_limits(value):
+    """"play=3/10,top=2/10" -> {"play": (3, 10.0)}: не больше 3 действий за 10 секунд"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        action, _, limit = item.partition("=")
+        count, _, seconds = limit.partition("/")
+        limits[action.strip()] = (int(count), float(seconds))
+    return limits
+
+
+# --- Защита от спама кнопками ---
+class ThrottleMiddleware(BaseMiddleware):
+    """Внутренний middleware: отсекает повторные нажатия до обработчика, а значит
+    до хранилища и ответов в чат.
+
+    Действие берётся из флага обработчика: flags={"throttle": "play"}. Обработчики
+    без флага не ограничиваются. На каждое (чат, игрок, действие) - своё ведро токенов
+    по limits[действие]; кроме того, одинаковый текст или callback data от того же
+    игрока в течение dedup_window секунд считается повтором. Отброшенному нажатию
+    кнопки отвечается пустым answer(), чтобы у пользователя не крутились часики.
+    """
+
+    CLEANUP_SIZE = 10000
+
+    def __init__(self, limits, dedup_window=1.5):
+        self.limits = limits
+        self.dedup_window = dedup_window
+        self._buckets = {}
+        self._recent = {}
+
+    async def __call__(self, handler, event, data):
+        action = get_flag(data, "throttle")
+        user = getattr(event, "from_user", None)
+        if action is None or user is None:
+            return await handler(event, data)
+
+        if isinstance(event, CallbackQuery):
+            # Та же кнопка под другим сообщением - уже не повтор
+            chat_id = event.message.chat.id if event.message else None
+            payload = (event.message.message_id if event.message else None, event.data)
+        else:
+            chat_id = event.chat.id
+            payload = event.text
+
+        now = time.monotonic()
+        reason = self._check(chat_id, user.id, action, payload, now)
+        if reason is None:
+            return await handler(event, data)
+
+        DROPPED.inc(action=action, reason=reason)
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer("⏳ Не так быстро!" if reason == "rate" else None)
+            except Exception:
+                pass
+        return None
+
+    def _check(self, chat_id, user_id, action, payload, now):
+        """None - пропустить, иначе причина отказа: duplicate или rate"""
+        if len(self._recent) > self.CLEANUP_SIZE or len(self._buckets) > self.CLEANUP_SIZE:
+            self._cleanup(now)
+
+        recent_key = (chat_id, user_id, payload)
+        seen = self._recent.get(recent_key)
+        if seen is not None and now - seen < self.dedup_window:
+            return "duplicate"
+        self._recent[recent_key] = now
+
+        limit = self.limits.get(action)
+        if limit is None:
+            return None
+        key = (chat_id, user_id, action)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            count, seconds = limit
+            bucket = self._buckets[key] = TokenBucket(count / seconds, count)
+        if bucket.delay(now) > 0:
+            return "rate"
+        bucket.take(now)
+        return None
+
+    def _cleanup(self, now):
+        self._recent = {key: seen for key, seen in self._recent.items() if now - seen < self.dedup_window}
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.is_idle(now)}
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from aiohttp import ClientSession, web
+from aiogram.types import Update
+
+from metrics import Counter, Gauge, Histogram
+
+UPDATE_LATENCY = Histogram("bot_webhook_update_seconds", "От получения апдейта до конца обработки (включая ответ)")
+UPDATE_LAG = Histogram(
+    "bot_webhook_update_lag_seconds", "От отправки сообщения пользователем до конца обработки",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+UPDATES_IN_FLIGHT = Gauge("bot_webhook_updates_in_flight", "Апдейтов в обработке")
+WEBHOOK_REQUESTS = Counter("bot_webhook_requests_total", "Запросов на вебхук", ["status"])
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# --- Вебхук ---
+class WebhookServer:
+    """Принимает апдейты от Telegram и сразу отвечает 200, а обработчики запускает в фоне.
+
+    В обработке одновременно не больше max_in_flight апдейтов: следующий запрос
+    ждёт свободного места, прежде чем получить ответ, и Telegram притормаживает.
+    """
+
+    def __init__(self, bot, dp, secret_token=None, max_in_flight=100):
+        self.bot = bot
+        self.dp = dp
+        self.secret_token = secret_token
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks = set()
+
+    async def handle(self, request):
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            WEBHOOK_REQUESTS.inc(status="forbidden")
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"Некорректный апдейт на вебхуке: {e}")
+            WEBHOOK_REQUESTS.inc(status="bad_request")
+            return web.Response(status=400)
+
+        received_at = time.monotonic()
+        await self._slots.acquire()
+        UPDATES_IN_FLIGHT.inc()
+        task = asyncio.create_task(self._process(update, received_at))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        WEBHOOK_REQUESTS.inc(status="ok")
+        return web.Response()
+
+    async def _process(self, update, received_at):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logging.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+            UPDATES_IN_FLIGHT.dec()
+            UPDATE_LATENCY.observe(time.monotonic() - received_at)
+            if update.message is not None:
+                UPDATE_LAG.observe(max(0.0, time.time() - update.message.date.timestamp()))
+
+    async def drain(self):
+        """Дожидается апдейтов, которые ещё обрабатываются"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_webhook(bot, dp, host, port, path, secret_token=None, public_url=None, max_in_flight=100):
+    server = WebhookServer(bot, dp, secret_token=secret_token, max_in_flight=max_in_flight)
+    app = web.Application()
+    app.router.add_post(path, server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Вебхук слушает http://{host}:{port}{path}")
+
+    if public_url:
+        await bot.set_webhook(
+            url=public_url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await server.drain()
+
+
+# --- Локальная проверка: отправить записанные апдейты на вебхук ---
+async def replay(path, url, secret_token=None):
+    headers = {SECRET_HEADER: secret_token} if secret_token else {}
+    async with ClientSession() as session:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                started = time.monotonic()
+                async with session.post(url, json=json.loads(line), headers=headers) as response:
+                    print(f"{response.status} {(time.monotonic() - started) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправить апдейты Telegram (по одному JSON в строке) на локальный вебхук")
+    parser.add_argument("updates")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret")
+    args = parser.parse_args()
+    asyncio.run(replay(args.updates, args.url, args.secret))